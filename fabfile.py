@@ -17,6 +17,11 @@ def alembic_revision(log_url):
     site via an alembic migration script.
 
     pulls the changelog from glottologcurator and create a new alembic revision with it.
+    The revision updates the closure table and descendant counts for the subtrees of
+    languoids which have been moved in the classification, the materialized ancestries,
+    the effective subclassification justifications, the coordinates for maps and the
+    statistics snapshots - with the helpers from migrations/curator.py, which are copied
+    into the revision, so it does not depend on application code.
     """
     user = raw_input('HTTP Basic auth user for glottologcurator: ')
     password = getpass('HTTP Basic auth password for glottologcurator: ')
@@ -30,6 +35,7 @@ def alembic_revision(log_url):
     scriptdir = ScriptDirectory.from_config(config)
     script = scriptdir.generate_revision(
         rev_id(), "Glottolog Curator", refresh=True,
+        imports=path('migrations').joinpath('curator.py').text(encoding='utf8'),
         upgrades="""\
 # from glottologcurator
     conn = op.get_bind()
@@ -37,6 +43,7 @@ def alembic_revision(log_url):
 %s
     ]:
         conn.execute(sql, params)
+    refresh(conn)
 """ % '\n'.join(u'    ("""{0}""", {1}),'.format(*event) for event in changes['events']))
 
     print('new alembic migration script created:')
@@ -2,6 +2,8 @@ from functools import partial
 from json import load
 
 from pyramid.response import Response
+from pyramid.events import ApplicationCreated
+from pyramid.tweens import INGRESS
 from pyramid.httpexceptions import HTTPGone
 from path import path
 from clld.interfaces import IMenuItems, ILanguage, ICtxFactoryQuery
@@ -16,8 +18,10 @@ from glottolog3 import models
 from glottolog3 import maps
 from glottolog3 import adapters
 from glottolog3 import datatables
+from glottolog3 import cache
 from glottolog3.config import CFG
 from glottolog3.interfaces import IProvider
+from glottolog3.legacy import LegacyCodes
 
 
 class GLCtxFactoryQuery(CtxFactoryQuery):
@@ -33,8 +37,12 @@ def main(global_config, **settings):
     """ This function returns a Pyramid WSGI application.
     """
     lc = path(glottolog3.__file__).dirname().joinpath('static', 'legacy_codes.json')
-    with open(lc) as fp:
-        settings['legacy_codes'] = load(fp)
+    try:
+        settings['legacy_codes'] = LegacyCodes.from_json(lc)
+    except (IOError, OSError):  # pragma: no cover
+        # the binary file could not be built, e.g. for lack of write permissions.
+        with open(lc) as fp:
+            settings['legacy_codes'] = load(fp)
 
     settings.update(CFG)
     settings['navbar.inverse'] = True
@@ -54,6 +62,14 @@ def main(global_config, **settings):
         routes=[
             ('languoid.xhtml', '/resource/languoid/id/{id:[^/\.]+}.xhtml'),
             ('reference.xhtml', '/resource/reference/id/{id:[^/\.]+}.xhtml')])
+    config.add_subscriber(cache.preload, ApplicationCreated)
+    if settings.get('glottolog3.fragment_cache_size'):
+        cache.fragment_cache.maxsize = int(settings['glottolog3.fragment_cache_size'])
+    # conditional GET must see the transaction managed DB session, thus we place the
+    # tween under pyramid_tm if available:
+    config.add_tween(
+        'glottolog3.tweens.conditional_get_tween_factory',
+        under=('pyramid_tm.tm_tween_factory', INGRESS))
     config.register_menu(
         ('dataset', partial(menu_item, 'dataset', label='Home')),
         ('languages', partial(menu_item, 'languages', label='Languoids')),
@@ -74,6 +90,12 @@ def main(global_config, **settings):
         views.glottologmeta,
         renderer='glottologmeta.mako')
 
+    config.add_route_and_view(
+        'glottolog.meta.json',
+        '/glottolog/glottologinformation.json',
+        views.glottologmeta,
+        renderer='json')
+
     config.add_route_and_view(
         'glottolog.families',
         '/glottolog/family',
@@ -85,6 +107,12 @@ def main(global_config, **settings):
         '/resource/languoid/iso/{id:[^/\.]+}',
         views.iso)
 
+    config.add_route_and_view(
+        'glottolog.isos',
+        '/resource/languoid/iso',
+        views.isos,
+        renderer='json')
+
     config.add_route_and_view(
         'glottolog.languages',
         '/glottolog/language',
@@ -97,6 +125,12 @@ def main(global_config, **settings):
         views.childnodes,
         renderer='json')
 
+    config.add_route_and_view(
+        'glottolog.cachestats',
+        '/db/cachestats',
+        views.cachestats,
+        renderer='json')
+
     config.add_route_and_view(
         'langdoc.complexquery',
         '/langdoc/complexquery',
@@ -0,0 +1,115 @@
+"""
+In-memory index of languoid names, glottocodes, hids and alternative names for the
+autocompletion of languoid selections.
+"""
+import unicodedata
+from heapq import nsmallest
+from bisect import bisect_left
+from array import array
+from collections import namedtuple
+
+from clld.db.meta import DBSession
+
+from glottolog3.cache import VersionedCache
+
+
+Match = namedtuple('Match', 'id name level')
+
+# rank of matches with respect to the level of the languoid:
+LEVELS = {'language': 0, 'family': 1, 'dialect': 2}
+# lengths of the substrings of keys indexed for infix lookup:
+NGRAM_SIZES = (1, 2, 3)
+
+
+def normalize(s):
+    """
+    :return: lowercase variant of s stripped of diacritics.
+    """
+    s = unicodedata.normalize('NFKD', u'%s' % s)
+    return u''.join(c for c in s if not unicodedata.combining(c)).lower().strip()
+
+
+def ngrams(s, n=3):
+    return set(s[i:i + n] for i in range(len(s) - n + 1))
+
+
+class AutocompleteIndex(object):
+    """Index supporting exact, prefix and infix lookup of normalized keys.
+
+    Keys are kept in a sorted list for exact and prefix matches via bisection; infix
+    matches are looked up in an index mapping the substrings of length one to three of
+    the keys to the positions of keys in the sorted list.
+    """
+    def __init__(self, languoids, keys):
+        """
+        :param languoids: iterable of (pk, id, name, level) tuples.
+        :param keys: iterable of (pk, key) pairs.
+        """
+        self.languoids = {}
+        for pk, id_, name, level in languoids:
+            self.languoids[pk] = Match(id_, name, getattr(level, 'value', level))
+        self.keys = sorted(set(
+            (normalize(key), pk) for pk, key in keys if key and pk in self.languoids))
+        self.ngrams = {}
+        for i, (key, pk) in enumerate(self.keys):
+            for n in NGRAM_SIZES:
+                for ngram in ngrams(key, n):
+                    self.ngrams.setdefault(ngram, array('i')).append(i)
+
+    @classmethod
+    def from_db(cls):
+        languoids = DBSession.execute("""\
+SELECT l.pk, l.id, l.name, ll.level, ll.hid
+FROM language as l, languoid as ll WHERE l.pk = ll.pk""").fetchall()
+        names = DBSession.execute("""\
+SELECT li.language_pk, i.name
+FROM languageidentifier as li, identifier as i
+WHERE li.identifier_pk = i.pk AND i.type = 'name'""").fetchall()
+        return cls(
+            [row[:4] for row in languoids],
+            [(row[0], row[k]) for row in languoids for k in [1, 2, 4]] + names)
+
+    def _infix(self, q):
+        """
+        :return: generator of positions of keys containing q.
+        """
+        if len(q) < 3:
+            # short queries are indexed themselves:
+            for i in self.ngrams.get(q, ()):
+                yield i
+            return
+        postings = sorted((self.ngrams.get(t, array('i')) for t in ngrams(q)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+        for i in candidates:
+            if q in self.keys[i][0]:
+                yield i
+
+    def search(self, q, limit=100):
+        """
+        :return: pair (list of at most limit Match objects, total number of matches).
+        """
+        q = normalize(q)
+        if not q:
+            return [], 0
+        ranks = {}
+        # exact and prefix matches are found by bisection:
+        i = bisect_left(self.keys, (q,))
+        while i < len(self.keys) and self.keys[i][0].startswith(q):
+            key, pk = self.keys[i]
+            ranks[pk] = min(ranks.get(pk, 2), 0 if key == q else 1)
+            i += 1
+        for i in self._infix(q):
+            pk = self.keys[i][1]
+            ranks.setdefault(pk, 2)
+
+        def sortkey(pk):
+            match = self.languoids[pk]
+            return ranks[pk], LEVELS.get(match.level, len(LEVELS)), match.name
+
+        return [self.languoids[pk] for pk in nsmallest(limit, ranks, key=sortkey)], \
+            len(ranks)
+
+
+autocomplete_index = VersionedCache(AutocompleteIndex.from_db)
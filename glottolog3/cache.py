@@ -0,0 +1,215 @@
+"""
+Per-worker caches for data derived from the database.
+
+Cached values are tagged with the data version, i.e. the last update of the dataset
+record, which is bumped whenever the cache tables are primed or a migration is applied.
+Workers look up the data version at most every CHECK_INTERVAL seconds and recompute
+stale values lazily.
+"""
+import sys
+import time
+from threading import Lock
+from collections import OrderedDict
+
+import transaction
+from clld.db.meta import DBSession
+
+# seconds
+CHECK_INTERVAL = 60
+# bytes
+FRAGMENT_CACHE_SIZE = 32 * 1024 * 1024
+# number of entries and seconds
+COUNT_CACHE_SIZE = 10000
+COUNT_CACHE_TTL = 600
+
+CACHES = []
+
+
+def get_data_version(db=None):
+    """
+    :return: timestamp of the last update of the data.
+    """
+    return (db or DBSession).execute('select max(updated) from dataset').scalar()
+
+
+def bump_data_version(db=None):
+    """Mark all cached data as stale - to be called after the data has been changed.
+    """
+    (db or DBSession).execute('update dataset set updated = now()')
+
+
+class VersionedCache(object):
+    """Container for a value computed by factory, recomputed when the data version
+    changes.
+    """
+    def __init__(self, factory, check_interval=CHECK_INTERVAL):
+        self.factory = factory
+        self.check_interval = check_interval
+        self.version = None
+        self.value = None
+        self.checked = None
+        self.lock = Lock()
+        CACHES.append(self)
+
+    def get(self):
+        now = time.time()
+        if self.checked is None or now - self.checked > self.check_interval:
+            with self.lock:
+                version = get_data_version()
+                if self.value is None or version != self.version:
+                    self.value = self.factory()
+                    self.version = version
+                self.checked = now
+        return self.value
+
+    def refresh(self):
+        """Force recomputation of the value upon next access.
+        """
+        with self.lock:
+            self.value = None
+            self.checked = None
+
+
+class FragmentCache(object):
+    """LRU cache for rendered HTML fragments, bounded by the total size of the fragments.
+
+    Fragments are only valid for the data version they have been rendered for; when the
+    data version changes, the cache is cleared.
+    """
+    def __init__(self, maxsize=FRAGMENT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.fragments = OrderedDict()
+        self.size = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key, render):
+        """
+        :param key: hashable key of the fragment, e.g. (languoid pk, section name).
+        :param render: callable returning the fragment - called on cache misses.
+        :return: the fragment.
+        """
+        version = data_version.get()
+        with self.lock:
+            if version != self.version:
+                self._clear()
+                self.version = version
+            fragment = self.fragments.pop(key, None)
+            if fragment is not None:
+                # re-insert to mark the fragment as most recently used:
+                self.fragments[key] = fragment
+                self.hits += 1
+                return fragment
+            self.misses += 1
+
+        fragment = render()
+        size = sys.getsizeof(fragment)
+        if size > self.maxsize:
+            return fragment
+        with self.lock:
+            if version == self.version and key not in self.fragments:
+                self.fragments[key] = fragment
+                self.size += size
+                while self.size > self.maxsize:
+                    _, evicted = self.fragments.popitem(last=False)
+                    self.size -= sys.getsizeof(evicted)
+        return fragment
+
+    def _clear(self):
+        self.fragments.clear()
+        self.size = 0
+
+    def refresh(self):
+        with self.lock:
+            self._clear()
+            self.version = None
+
+    def stats(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            fragments=len(self.fragments),
+            size=self.size,
+            maxsize=self.maxsize)
+
+
+class CountCache(object):
+    """LRU cache for row counts of queries, bounded by the number of entries.
+
+    Counts expire after ttl seconds and are cleared when the data version changes.
+    """
+    def __init__(self, maxsize=COUNT_CACHE_SIZE, ttl=COUNT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.counts = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key, count):
+        """
+        :param key: hashable key of the count.
+        :param count: callable returning the count - called on cache misses.
+        :return: the count.
+        """
+        version = data_version.get()
+        now = time.time()
+        with self.lock:
+            if version != self.version:
+                self.counts.clear()
+                self.version = version
+            entry = self.counts.pop(key, None)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self.counts[key] = entry
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        n = count()
+        with self.lock:
+            if version == self.version:
+                self.counts[key] = (n, now)
+                while len(self.counts) > self.maxsize:
+                    self.counts.popitem(last=False)
+        return n
+
+    def refresh(self):
+        with self.lock:
+            self.counts.clear()
+            self.version = None
+
+    def stats(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            counts=len(self.counts),
+            maxsize=self.maxsize)
+
+
+def refresh():
+    """Refresh hook, invalidating all caches of the worker.
+    """
+    for cache in CACHES:
+        cache.refresh()
+    fragment_cache.refresh()
+    count_cache.refresh()
+
+
+def preload(event):
+    """Subscriber for ApplicationCreated, filling all caches if so configured.
+    """
+    if event.app.registry.settings.get('glottolog3.preload_caches') in ['true', True]:
+        with transaction.manager:
+            for cache in CACHES:
+                cache.get()
+
+
+# the data version itself, looked up at most every CHECK_INTERVAL seconds:
+data_version = VersionedCache(get_data_version)
+# rendered fragments of languoid detail pages, see templates/language/detail_html.mako:
+fragment_cache = FragmentCache()
+# row counts of datatable queries, see glottolog3.datatables:
+count_cache = CountCache()
@@ -2,22 +2,51 @@ from __future__ import unicode_literals
 import re
 
 from purl import URL
-from sqlalchemy import func, or_, and_
-from sqlalchemy.orm import joinedload, joinedload_all, aliased
+from sqlalchemy import func, or_, and_, tuple_
+from sqlalchemy.orm import Query
 from clld.web.datatables.base import DataTable, Col, LinkCol, DetailsRowLinkCol
 from clld.web.util.helpers import button, JSModal, icon, link
 from clld.web.util.htmllib import HTML
 from clld.db.meta import DBSession
-from clld.db.util import get_distinct_values, icontains
-from clld.db.models.common import Language, LanguageSource
+from clld.db.util import icontains
+from clld.db.models.common import LanguageSource, Source
 from clld.web.datatables.language import Languages
 from clld.web.datatables.source import Sources
 
 from glottolog3.models import (
-    Macroarea, Languoidmacroarea, Languoid, TreeClosureTable,
+    Macroarea, LanguoidListing, DescendantCount,
     LanguoidLevel, LanguoidStatus, Provider, Refprovider, Refdoctype, Doctype, Ref,
 )
-from glottolog3.util import getRefs, get_params, languoid_link
+from glottolog3.util import getRefs, get_params, descendants
+from glottolog3.cache import count_cache, VersionedCache
+from glottolog3.vocabulary import get_vocabulary
+
+
+class CountCachingQuery(Query):
+    """Query looking up its row count in the count cache.
+
+    The count is keyed by a label - typically the datatable class - and the SQL and
+    parameters of the query without ordering and paging, i.e. all pages and sort orders
+    of the same filtered query share one count.
+    """
+    def __init__(self, entities, session=None, label=None):
+        super(CountCachingQuery, self).__init__(entities, session=session)
+        self._count_label = label
+
+    def count(self):
+        query = self.order_by(None).limit(None).offset(None)
+        sql = query.statement.compile(dialect=self.session.get_bind().dialect)
+        key = (self._count_label, '%s' % sql, repr(sorted(sql.params.items())))
+        return count_cache.get(key, lambda: Query.count(self))
+
+
+def cached_counts(model, label):
+    """
+    :return: query of the active instances of model, with counts looked up in the count\
+    cache - to be used in place of the query passed into DataTable.base_query.
+    """
+    return CountCachingQuery(model, session=DBSession(), label=label)\
+        .filter(model.active == True)
 
 
 class RefCountCol(Col):
@@ -39,22 +68,29 @@ class Providers(DataTable):
         ]
 
 
+def listing_link(req, id_, name, level):
+    return HTML.span(
+        HTML.a(
+            name, href=req.route_url('language', id=id_), title=name, class_='Languoid'),
+        class_='level-' + getattr(level, 'value', level))
+
+
 class NameCol(Col):
     def format(self, item):
-        return languoid_link(self.dt.req, item)
+        return listing_link(self.dt.req, item.id, item.name, item.level)
 
 
 class StatusCol(Col):
     def __init__(self, dt, name='status', **kw):
         kw['sFilter'] = LanguoidStatus.established.value
-        kw['choices'] = get_distinct_values(Languoid.status)
+        kw['choices'] = get_vocabulary('statuses')
         super(StatusCol, self).__init__(dt, name, **kw)
 
     def search(self, qs):
-        return Languoid.status == getattr(LanguoidStatus, qs, None)
+        return LanguoidListing.status == getattr(LanguoidStatus, qs, None)
 
     def order(self):
-        return Languoid.status
+        return LanguoidListing.status
 
 
 class LevelCol(Col):
@@ -65,30 +101,21 @@ class LevelCol(Col):
         super(LevelCol, self).__init__(dt, name, **kw)
 
     def format(self, item):
-        if item.father_pk is None:
-            if item.level == LanguoidLevel.family:
-                return 'Top-level family'
-            else:
-                return 'Isolate'
-        return 'Subfamily'
+        return item.level_label
 
     def search(self, qs):
-        if qs == 'Top-level family':
-            return and_(Languoid.father_pk.__eq__(None),
-                        Languoid.level == LanguoidLevel.family)
-        if qs == 'Isolate':
-            return and_(Languoid.father_pk.__eq__(None),
-                        Languoid.level == LanguoidLevel.language)
+        if qs in ['Top-level family', 'Isolate']:
+            return LanguoidListing.level_label == qs
         if qs == 'Top-level unit':
-            return Languoid.father_pk.__eq__(None)
+            return LanguoidListing.father_pk.__eq__(None)
         if qs == 'Subfamily':
-            return and_(Languoid.father_pk.__ne__(None),
-                        Languoid.level == LanguoidLevel.family)
+            return and_(LanguoidListing.father_pk.__ne__(None),
+                        LanguoidListing.level == LanguoidLevel.family)
 
 
 class MacroareaCol(Col):
     def __init__(self, dt, name, **kw):
-        self.macroareas = DBSession.query(Macroarea).order_by(Macroarea.id).all()
+        self.macroareas = get_vocabulary(Macroarea)
         kw['bSortable'] = False
         desc = []
         for area in self.macroareas:
@@ -98,66 +125,113 @@ class MacroareaCol(Col):
         super(MacroareaCol, self).__init__(dt, name, **kw)
 
     def format(self, item):
-        return ', '.join(a.name for a in item.macroareas)
+        return item.macroareas
 
     def search(self, qs):
-        return Languoidmacroarea.macroarea_pk == int(qs)
+        return LanguoidListing.macroarea_pks.contains([int(qs)])
 
     @property
     def choices(self):
         return [(a.pk, a.name) for a in self.macroareas]
 
 
-class RefCol(Col):
-    def format(self, item):
-        return format_justifications(self.dt.req, item)
-
-
 class IsoCol(Col):
     def format(self, item):
-        if item.hid and len(item.hid) == 3:
-            return item.hid
+        return item.iso_code
 
     def order(self):
-        return Languoid.hid
+        return LanguoidListing.iso_code
 
     def search(self, qs):
-        return Languoid.hid.contains(qs.lower())
+        return LanguoidListing.iso_code.contains(qs.lower())
 
 
 class FamilyCol(Col):
     def format(self, item):
-        if item.family_pk:
-            return languoid_link(self.dt.req, item.family)
+        if item.family_id:
+            return listing_link(
+                self.dt.req, item.family_id, item.family_name, LanguoidLevel.family)
 
     def order(self):
-        return self.dt.top_level_family.name
+        return LanguoidListing.family_name
 
     def search(self, qs):
-        return icontains(self.dt.top_level_family.name, qs)
+        return icontains(LanguoidListing.family_name, qs)
+
+
+class ChildCountCol(Col):
+    """Number of descendants of a level - located in the macroarea the listing is
+    filtered by, if any.
+    """
+    def __init__(self, dt, name, level, **kw):
+        self.level = level
+        kw['model_col'] = getattr(LanguoidListing, name)
+        super(ChildCountCol, self).__init__(dt, name, **kw)
+
+    def format(self, item):
+        if self.dt.macroarea_pk is None:
+            return getattr(item, self.name)
+        return self.dt.descendant_counts(self.level).get(item.languoid_pk, 0)
+
+    def order(self):
+        if self.dt.macroarea_pk is None:
+            return self.model_col
+        return DBSession.query(func.coalesce(func.sum(DescendantCount.count), 0))\
+            .filter(DescendantCount.languoid_pk == LanguoidListing.languoid_pk)\
+            .filter(DescendantCount.macroarea_pk == self.dt.macroarea_pk)\
+            .filter(DescendantCount.level == self.level)\
+            .as_scalar()
 
 
 class Families(Languages):
+    """Listing of families or languages, served from the denormalized LanguoidListing.
+    """
     def __init__(self, req, model, **kw):
         self.type = kw.pop('type', req.params.get('type', 'families'))
-        self.top_level_family = aliased(Language)
-        super(Families, self).__init__(req, model, **kw)
+        self._descendant_counts = {}
+        self._page = None
+        super(Families, self).__init__(req, LanguoidListing, **kw)
+
+    @property
+    def macroarea_pk(self):
+        """
+        :return: pk of the macroarea the listing is filtered by or None.
+        """
+        for i, col in enumerate(self.cols):
+            if isinstance(col, MacroareaCol):
+                try:
+                    return int(self.req.params.get('sSearch_%s' % i))
+                except (TypeError, ValueError):
+                    return None
+
+    def descendant_counts(self, level):
+        """
+        :return: dict mapping pks of the languoids on the current page to the number of\
+        descendants of the level located in the macroarea the listing is filtered by.
+        """
+        if level not in self._descendant_counts:
+            page = self.get_query() if self._page is None else self._page
+            self._descendant_counts[level] = DescendantCount.get_counts(
+                [pk for pk, in page.with_entities(LanguoidListing.languoid_pk)],
+                level=level,
+                macroarea_pk=self.macroarea_pk)
+        return self._descendant_counts[level]
+
+    def get_query(self, limit=1000, offset=0):
+        self._page = super(Families, self).get_query(limit=limit, offset=offset)
+        return self._page
 
     def base_query(self, query):
-        query = query.filter(Language.active == True)\
-            .filter(Languoid.status == LanguoidStatus.established)\
-            .outerjoin(Languoidmacroarea)\
-            .outerjoin(self.top_level_family, self.top_level_family.pk == Languoid.family_pk)\
-            .distinct()\
-            .options(joinedload(Languoid.macroareas))
+        query = cached_counts(self.model, self.__class__.__name__)\
+            .filter(LanguoidListing.status == LanguoidStatus.established)
 
         if self.type == 'families':
             return query.filter(
-                or_(Languoid.level == LanguoidLevel.family,
-                    and_(Languoid.level == LanguoidLevel.language,
-                         Languoid.father_pk == None)))
+                or_(LanguoidListing.level == LanguoidLevel.family,
+                    and_(LanguoidListing.level == LanguoidLevel.language,
+                         LanguoidListing.father_pk == None)))
         else:
-            return query.filter(Languoid.level == LanguoidLevel.language)
+            return query.filter(LanguoidListing.level == LanguoidLevel.language)
 
     def col_defs(self):
         if self.type == 'families':
@@ -166,8 +240,8 @@ class Families(Languages):
                 #StatusCol(self),
                 LevelCol(self),
                 MacroareaCol(self, 'macro-area'),
-                Col(self, 'child_family_count', model_col=Languoid.child_family_count, sTitle='Sub-families'),
-                Col(self, 'child_language_count', model_col=Languoid.child_language_count, sTitle='Child languages'),
+                ChildCountCol(self, 'child_family_count', LanguoidLevel.family, sTitle='Sub-families'),
+                ChildCountCol(self, 'child_language_count', LanguoidLevel.language, sTitle='Child languages'),
                 #Col(self, 'child_dialect_count', sTitle='Child dialects'),
                 FamilyCol(self, 'top-level family'),
             ]
@@ -179,7 +253,7 @@ class Families(Languages):
                 IsoCol(self, 'iso', sTitle='ISO-639-3'),
                 #StatusCol(self),
                 MacroareaCol(self, 'macro-area'),
-                Col(self, 'child_dialect_count', sTitle='Child dialects'),
+                ChildCountCol(self, 'child_dialect_count', LanguoidLevel.dialect, sTitle='Child dialects'),
             ]
 
     def get_options(self):
@@ -192,7 +266,7 @@ class Families(Languages):
 
 class DoctypeCol(Col):
     def __init__(self, dt, name, **kw):
-        self.doctypes = DBSession.query(Doctype).order_by(Doctype.id).all()
+        self.doctypes = get_vocabulary(Doctype)
         kw['bSortable'] = False
         super(DoctypeCol, self).__init__(dt, name, **kw)
 
@@ -207,6 +281,45 @@ class DoctypeCol(Col):
         return [(a.pk, a.name) for a in self.doctypes]
 
 
+# stable sort key of refs for keyset pagination, matching index ix_source_author_year_pk:
+REF_SORT_KEY = [
+    func.coalesce(Source.author, ''), func.coalesce(Source.year, ''), Source.pk]
+
+
+class RefBookmarks(object):
+    """Sort keys of every step-th active ref in the order of REF_SORT_KEY.
+
+    Pages of the unfiltered, unsorted refs listing are looked up by seeking past the
+    closest preceding bookmark, so the cost of a page does not depend on its offset.
+    """
+    def __init__(self, keys, step):
+        self.keys = keys
+        self.step = step
+
+    @classmethod
+    def from_db(cls, step=1000):
+        return cls([tuple(row) for row in DBSession.execute("""\
+SELECT author, year, pk FROM (
+    SELECT
+        coalesce(s.author, '') AS author, coalesce(s.year, '') AS year, s.pk,
+        row_number() OVER (ORDER BY coalesce(s.author, ''), coalesce(s.year, ''), s.pk)
+        AS rn
+    FROM source AS s JOIN ref AS r ON s.pk = r.pk
+    WHERE s.active
+) AS t WHERE mod(t.rn, %s) = 0 ORDER BY t.rn""" % step)], step)
+
+    def seek(self, offset):
+        """
+        :return: pair (sort key of the ref preceding the closest bookmark or None, offset\
+        relative to the bookmark).
+        """
+        i = min(offset // self.step, len(self.keys))
+        return (self.keys[i - 1] if i else None), offset - i * self.step
+
+
+ref_bookmarks = VersionedCache(RefBookmarks.from_db)
+
+
 class Refs(Sources):
     def __init__(self, req, *args, **kw):
         if 'cq' in kw:
@@ -225,15 +338,45 @@ class Refs(Sources):
             cols.append(DoctypeCol(self, 'doctype'))
         return cols
 
+    def keyset(self):
+        """
+        :return: flag signaling whether pages can be looked up via bookmarks, i.e. whether\
+        the listing is neither filtered nor explicitly sorted.
+        """
+        if self.language or self.complexquery:
+            return False
+        for key, value in self.req.params.items():
+            if key.startswith('sSearch') and value:
+                return False
+        return not int(self.req.params.get('iSortingCols', 0) or 0)
+
     def base_query(self, query):
+        query = cached_counts(self.model, self.__class__.__name__)
+        if self.keyset():
+            query = query.order_by(*REF_SORT_KEY)
         if self.language:
             query = query.join(LanguageSource)\
-                .join(TreeClosureTable, TreeClosureTable.child_pk == LanguageSource.language_pk)\
-                .filter(TreeClosureTable.parent_pk == self.language.pk)
+                .filter(LanguageSource.language_pk.in_(descendants([self.language])))
             query = query.outerjoin(Refdoctype, Ref.pk == Refdoctype.ref_pk)\
                 .distinct()
         elif self.complexquery:
-            query = getRefs(self.complexquery[0])
+            refs = getRefs(self.complexquery[0])
+            query = query.filter(Ref.pk.in_(refs.subquery())) if refs \
+                else query.filter(Ref.pk == None)
+        return query
+
+    def get_query(self, limit=1000, offset=0):
+        query = super(Refs, self).get_query(limit=limit, offset=offset)
+        if self.keyset():
+            seek, offset = ref_bookmarks.get().seek(query._offset or 0)
+            if seek:
+                # the page is looked up by seeking past the closest preceding bookmark,
+                # with the offset taken relative to the bookmark; the rows have already
+                # been counted.
+                limit = query._limit
+                query = query.limit(None).offset(None)\
+                    .filter(tuple_(*REF_SORT_KEY) > tuple_(*seek))\
+                    .limit(limit).offset(offset)
         return query
 
     def get_options(self):
@@ -242,4 +385,7 @@ class Refs(Sources):
             query = {'cq': '1'}
             query.update(self.complexquery[1])
             opts['sAjaxSource'] = self.req.route_url('sources', _query=query)
+        if not self.language and not self.complexquery:
+            # initially unsorted, to allow keyset pagination - see keyset:
+            opts['aaSorting'] = []
         return opts
@@ -0,0 +1,78 @@
+"""
+Full-text search for the bibliographical fields of references.
+
+Each Ref carries a search document - a tsvector of its biblio fields - in column
+ref.fts, indexed with GIN. Filters on biblio fields are translated to prefix queries
+on the tokens of the search document, re-checked against the single field on the small
+set of candidates.
+
+The search documents are computed by prime_cache, import_refs and the migration which
+introduced them; functions accept an optional db argument - a session or connection -
+defaulting to DBSession.
+"""
+import re
+import time
+import logging
+
+from sqlalchemy import func
+from clld.db.meta import DBSession
+from clld.db.util import icontains
+
+from glottolog3.models import Ref
+
+log = logging.getLogger(__name__)
+
+# the text search configuration: no stemming or stop words, i.e. just lowercase tokens.
+CONFIG = 'simple'
+FIELDS = ['author', 'year', 'title', 'editor', 'journal', 'address', 'publisher']
+TOKEN_PATTERN = re.compile('[^\W_]+', re.UNICODE)
+
+
+def update_fts(pks=None, db=None):
+    """Compute the search documents of all refs or only of those with the given pks.
+    """
+    start = time.time()
+    sql = """\
+UPDATE ref SET fts = to_tsvector('%s', concat_ws(' ', %s))
+FROM source AS s WHERE s.pk = ref.pk""" % (
+        CONFIG, ', '.join('s.%s' % field for field in FIELDS))
+    db = db or DBSession
+    if pks is None:
+        n = db.execute(sql).rowcount
+    else:
+        n = 0
+        pks = list(pks)
+        for i in range(0, len(pks), 1000):
+            batch = ','.join('%d' % pk for pk in pks[i:i + 1000])
+            n += db.execute(sql + ' AND ref.pk IN (%s)' % batch).rowcount
+    log.info('fts: %s refs updated in %.2fs', n, time.time() - start)
+    return n
+
+
+def tsquery(value):
+    """
+    :return: query string for to_tsquery, matching documents containing tokens\
+    starting with each of the words in value, or None if value contains no words.
+    """
+    tokens = TOKEN_PATTERN.findall(value.lower())
+    if tokens:
+        return ' & '.join('%s:*' % token for token in tokens)
+
+
+def matches(field, value):
+    """
+    :return: list of criteria selecting refs where field matches value.
+    """
+    q = tsquery(value)
+    if not q:
+        return [icontains(getattr(Ref, field), value)]
+    query = func.to_tsquery(CONFIG, q)
+    res = [
+        Ref.fts.op('@@')(query),
+        func.to_tsvector(CONFIG, func.coalesce(getattr(Ref, field), ''))
+        .op('@@')(query),
+    ]
+    if len(TOKEN_PATTERN.findall(value)) > 1:
+        # phrase matching: the words must appear in sequence.
+        res.append(icontains(getattr(Ref, field), value))
+    return res
@@ -0,0 +1,96 @@
+"""
+Compact binary representation of the set of legacy languoid codes which are no longer
+supported, i.e. for which we respond with "410 Gone".
+
+The set is built from static/legacy_codes.json. Numeric codes - the ids of glottolog 2 -
+are stored as bitset, all other codes as sorted fixed-width records. The file is mapped
+into memory read-only, thus shared by all worker processes on a host.
+
+File layout: header (magic, width of records, size of bitset in bytes, number of
+records), bitset, records.
+"""
+import os
+import json
+import mmap
+import struct
+
+MAGIC = b'GLC1'
+HEADER = struct.Struct('<4sIII')
+
+
+def _numeric(code):
+    return code.isdigit() and '%d' % int(code) == code
+
+
+def build(src, dest):
+    """write the binary representation of the codes in JSON file src to dest.
+    """
+    with open(src) as fp:
+        codes = json.load(fp)
+    numbers = [int(code) for code in codes if _numeric(code)]
+    records = sorted(code.encode('ascii') for code in codes if not _numeric(code))
+    width = max(len(r) for r in records) if records else 1
+    bitset = bytearray((max(numbers) >> 3) + 1 if numbers else 0)
+    for n in numbers:
+        bitset[n >> 3] |= 1 << (n & 7)
+
+    # we write to a temporary file first, so concurrently starting workers never see
+    # an incomplete file.
+    tmp = '%s.%s' % (dest, os.getpid())
+    with open(tmp, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, width, len(bitset), len(records)))
+        fp.write(bytes(bitset))
+        for record in records:
+            fp.write(record.ljust(width, b'\0'))
+    os.rename(tmp, dest)
+
+
+class LegacyCodes(object):
+    """Read-only set of legacy codes, supporting fast membership tests.
+    """
+    def __init__(self, fname):
+        with open(fname, 'rb') as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.width, self.bitset_size, self.n = HEADER.unpack_from(self.mm, 0)
+        assert magic == MAGIC
+        self.offset = HEADER.size + self.bitset_size
+
+    @classmethod
+    def from_json(cls, src, dest=None):
+        """
+        :return: LegacyCodes instance for the JSON file src, (re-)building the binary\
+        file dest - by default src with suffix .bin - if it is missing or outdated.
+        """
+        dest = dest or os.path.splitext(src)[0] + '.bin'
+        if not os.path.exists(dest) or os.path.getmtime(dest) < os.path.getmtime(src):
+            build(src, dest)
+        return cls(dest)
+
+    def __len__(self):
+        return self.n + sum(
+            bin(b).count('1') for b in
+            struct.unpack_from('%dB' % self.bitset_size, self.mm, HEADER.size))
+
+    def _record(self, i):
+        start = self.offset + i * self.width
+        return self.mm[start:start + self.width]
+
+    def __contains__(self, code):
+        if _numeric(code):
+            n = int(code)
+            if (n >> 3) >= self.bitset_size:
+                return False
+            return bool(
+                struct.unpack_from('B', self.mm, HEADER.size + (n >> 3))[0] & (1 << (n & 7)))
+        try:
+            key = code.encode('ascii').ljust(self.width, b'\0')
+        except UnicodeError:
+            return False
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < self.n and self._record(lo) == key
@@ -0,0 +1,52 @@
+"""
+Denormalized listing of languoids, backing the Families/Languages datatables.
+
+The listing holds one row per languoid with the top-level family, macroareas, ISO code,
+level label and child counts, so the datatables can sort and filter without joins. It
+is refreshed by prime_cache - curator migrations run a copy of the SQL, see
+migrations/curator.py. Functions accept an optional db argument - a session or
+connection - defaulting to DBSession.
+"""
+import time
+import logging
+
+from clld.db.meta import DBSession
+
+log = logging.getLogger(__name__)
+
+
+def update_listing(db=None):
+    """Rebuild the listing from the languoid tables.
+    """
+    start = time.time()
+    db = db or DBSession
+    db.execute('DELETE FROM languoidlisting')
+    n = db.execute("""\
+INSERT INTO languoidlisting (
+    active, created, updated, languoid_pk, id, name, level, status, level_label,
+    father_pk, family_id, family_name, iso_code, macroarea_pks, macroareas,
+    child_family_count, child_language_count, child_dialect_count)
+SELECT
+    l.active, now(), now(), l.pk, l.id, l.name, ll.level, ll.status,
+    CASE
+        WHEN ll.father_pk IS NULL AND ll.level = 'family' THEN 'Top-level family'
+        WHEN ll.father_pk IS NULL THEN 'Isolate'
+        ELSE 'Subfamily'
+    END,
+    ll.father_pk, f.id, f.name,
+    CASE WHEN length(ll.hid) = 3 THEN ll.hid END,
+    coalesce(m.pks, '{}'), coalesce(m.names, ''),
+    ll.child_family_count, ll.child_language_count, ll.child_dialect_count
+FROM language AS l
+JOIN languoid AS ll ON l.pk = ll.pk
+LEFT OUTER JOIN language AS f ON f.pk = ll.family_pk
+LEFT OUTER JOIN (
+    SELECT
+        lm.languoid_pk,
+        array_agg(ma.pk ORDER BY ma.id) AS pks,
+        string_agg(ma.name, ', ' ORDER BY ma.id) AS names
+    FROM languoidmacroarea AS lm JOIN macroarea AS ma ON lm.macroarea_pk = ma.pk
+    GROUP BY lm.languoid_pk
+) AS m ON m.languoid_pk = l.pk""").rowcount
+    log.info('listing: %s languoids in %.2fs', n, time.time() - start)
+    return n
@@ -17,16 +17,22 @@ from sqlalchemy import (
     ForeignKey,
     Float,
     DateTime,
-    desc,
     UniqueConstraint,
+    Index,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR, ARRAY
+from sqlalchemy.orm import (
+    relationship, backref, contains_eager, joinedload_all, deferred,
 )
-from sqlalchemy.orm import relationship, backref
 from sqlalchemy.sql.expression import func
 from sqlalchemy.ext.hybrid import hybrid_property
 
 from clld.interfaces import ISource, ILanguage
-from clld.db.meta import DBSession, Base, CustomModelMixin
-from clld.db.models.common import Language, Source, HasSourceMixin, IdNameDescriptionMixin
+from clld.db.meta import DBSession, Base, CustomModelMixin, JSONEncodedDict
+from clld.db.models.common import (
+    Language, Source, ValueSet, ValueSetReference, Parameter, HasSourceMixin,
+    IdNameDescriptionMixin,
+)
 from clld.web.util.htmllib import literal
 from clld.lib import bibtex
 from clld.util import UnicodeMixin
@@ -120,12 +126,13 @@ class Refprovider(Base):
 
     @classmethod
     def get_stats(cls):
-        return dict(
-            DBSession.query(Provider.pk, func.count(cls.ref_pk).label('c'))
-            .filter(Provider.pk == cls.provider_pk)
-            .group_by(Provider.pk)
-            .order_by(desc('c'))
-            .all())
+        """
+        :return: dict mapping provider pks to the number of refs - from the per-worker\
+        cache of the provider statistics snapshot.
+        """
+        from glottolog3.stats import provider_statistics
+
+        return provider_statistics.get()['ref_count']
 
 
 #-----------------------------------------------------------------------------
@@ -146,6 +153,25 @@ class LanguoidStatus(DeclEnum):
     retired = 'retired', 'retired'
 
 
+@implementer(ILanguage)
+class Ancestor(UnicodeMixin):
+    """Lightweight stand-in for an ancestor Languoid, read from Languoid.ancestry.
+
+    Providing ILanguage, an Ancestor can be linked like a Languoid.
+    """
+    def __init__(self, pk, id, name, level, fc, sc):
+        self.pk = pk
+        self.id = id
+        self.name = name
+        self.level = LanguoidLevel.from_string(level)
+        # flags signaling whether the languoid has a classification comment:
+        self.fc = fc
+        self.sc = sc
+
+    def __unicode__(self):
+        return self.name
+
+
 @implementer(ILanguage)
 class Languoid(Language, CustomModelMixin):
     """
@@ -174,6 +200,24 @@ class Languoid(Language, CustomModelMixin):
     child_language_count = Column(Integer)
     child_dialect_count = Column(Integer)
 
+    # nested interval of preorder numbers: the descendants of a languoid are the languoids
+    # with lft in (lft, rgt].
+    lft = Column(Integer, index=True)
+    rgt = Column(Integer)
+
+    # materialized line of ancestors, starting with the top-level family, as list of
+    # [pk, id, name, level, fc, sc] lists - see Ancestor.
+    ancestry = Column(JSONEncodedDict)
+
+    # the sc valueset providing the subclassification justification for the languoid,
+    # i.e. its own or the one of the closest ancestor with references - see screfs.
+    sc_valueset_pk = Column(Integer, ForeignKey('valueset.pk'))
+    sc_valueset = relationship(ValueSet, foreign_keys=[sc_valueset_pk])
+
+    # coordinates of descendants as list of [branch_pk, name, longitude, latitude, id]
+    # lists - see get_geocoords. Deferred, because it may be big for top-level families.
+    geocoords = deferred(Column(JSONEncodedDict))
+
     descendants = relationship(
         'Languoid',
         order_by='Languoid.name, Languoid.id',
@@ -205,10 +249,34 @@ class Languoid(Language, CustomModelMixin):
         :return: Generator yielding the line of ancestors of self back to the top-level\
         family.
         """
-        languoid = self
-        while languoid.father:
-            languoid = languoid.father
-            yield languoid
+        from glottolog3.tree import tree_index
+
+        index = tree_index.get()
+        if self.pk not in index or index.father_pk(self.pk) != self.father_pk:
+            # the index is not up-to-date for self, so we follow the ORM relationship.
+            languoid = self
+            while languoid.father:
+                languoid = languoid.father
+                yield languoid
+            return
+
+        pks = index.ancestors(self.pk)
+        if pks:
+            ancestors = dict(
+                (l.pk, l) for l in DBSession.query(Languoid).filter(Languoid.pk.in_(pks)))
+            for pk in pks:
+                yield ancestors[pk]
+
+    def get_ancestry(self):
+        """
+        :return: list of Ancestor objects, starting with the top-level family.
+        """
+        if self.ancestry is not None:
+            return [Ancestor(*a) for a in self.ancestry]
+        return [
+            Ancestor(
+                l.pk, l.id, l.name, l.level.value, bool(l.fc), bool(l.sc))
+            for l in reversed(list(self.get_ancestors()))]
 
     def get_geocoords(self):
         """
@@ -220,7 +288,13 @@ class Languoid(Language, CustomModelMixin):
 
             This method does not return the geo coordinates of the Languoid self, but of
             its descendants.
+
+        .. note::
+
+            If available, the precomputed geocoords are returned as list of tuples.
         """
+        if self.geocoords is not None:
+            return [tuple(c) for c in self.geocoords]
         child_pks = DBSession.query(Languoid.pk)\
             .filter(Languoid.father_pk == self.pk).subquery()
         return DBSession.query(
@@ -233,22 +307,44 @@ class Languoid(Language, CustomModelMixin):
             .filter(TreeClosureTable.parent_pk.in_(child_pks))\
             .filter(Language.latitude != None)
 
+    @staticmethod
+    def load_classifications(languoids):
+        """Load the fc and sc valuesets of languoids, including their references, with
+        one query.
+
+        The valuesets are stored with the languoid instances, i.e. they are cached for
+        the lifetime of the session - which is the current request.
+        """
+        languoids = dict((l.pk, l) for l in languoids)
+        if not languoids:
+            return
+        for l in languoids.values():
+            l._classifications = {}
+        for vs in DBSession.query(ValueSet)\
+                .join(Parameter)\
+                .filter(Parameter.id.in_(['fc', 'sc']))\
+                .filter(ValueSet.language_pk.in_(list(languoids.keys())))\
+                .options(
+                    contains_eager(ValueSet.parameter),
+                    joinedload_all(ValueSet.references, ValueSetReference.source)):
+            languoids[vs.language_pk]._classifications[vs.parameter.id] = vs
+
     def classification(self, type_):
         assert type_ in ['fc', 'sc']
-        for vs in self.valuesets:
-            if vs.parameter.id == type_:
-                return vs
+        if getattr(self, '_classifications', None) is None:
+            Languoid.load_classifications([self])
+        return self._classifications.get(type_)
 
     @property
     def fc(self):
         c = self.classification('fc')
-        if c.description:
+        if c and c.description:
             return c
 
     @property
     def sc(self):
         c = self.classification('sc')
-        if c.description:
+        if c and c.description:
             return c
 
     def _crefs(self, t):
@@ -270,12 +366,24 @@ class Languoid(Language, CustomModelMixin):
         own justification (in which case that ref supersedes and takes over everything
         below). Suppose one is looking at a subfamily without its own
         explicit justification, then one should get the parent justification.
+
+        The valueset providing the effective justification is precomputed as
+        sc_valueset.
         """
-        res = self._crefs('sc')
-        if not res:
-            if self.father:
-                res = self.father.screfs
-        return res
+        if self.sc_valueset:
+            return list(self.sc_valueset.references)
+        # not precomputed, or no justification at all: look up the valueset of the
+        # languoid or its closest ancestor.
+        vs = DBSession.query(ValueSet)\
+            .join(Parameter)\
+            .filter(Parameter.id == 'sc')\
+            .filter(ValueSet.references.any())\
+            .join(TreeClosureTable, TreeClosureTable.parent_pk == ValueSet.language_pk)\
+            .filter(TreeClosureTable.child_pk == self.pk)\
+            .order_by(TreeClosureTable.depth, ValueSet.pk)\
+            .options(joinedload_all(ValueSet.references, ValueSetReference.source))\
+            .first()
+        return list(vs.references) if vs else []
 
     def __rdf__(self, request):
         if self.father:
@@ -317,6 +425,8 @@ class Ref(Source, CustomModelMixin):
     normalizedauthorstring = Column(Unicode)
     normalizededitorstring = Column(Unicode)
     ozbib_id = Column(Integer)
+    # search document for the biblio fields, see glottolog3.fts:
+    fts = deferred(Column(TSVECTOR))
 
     providers = relationship(
         Provider,
@@ -371,6 +481,84 @@ class Ref(Source, CustomModelMixin):
         """
 
 
+Index('ix_ref_fts', Ref.__table__.c.fts, postgresql_using='gin')
+# for keyset pagination of refs - see glottolog3.datatables.REF_SORT_KEY:
+Index(
+    'ix_source_author_year_pk',
+    func.coalesce(Source.__table__.c.author, ''),
+    func.coalesce(Source.__table__.c.year, ''),
+    Source.__table__.c.pk)
+
+
+class Statistics(Base):
+    """Snapshot of figures computed from the data - see glottolog3.stats.
+    """
+    id = Column(Unicode, unique=True)
+    data = Column(JSONEncodedDict)
+
+
+class DescendantCount(Base):
+    """Number of descendants of a languoid with a given level and status, either in total
+    (macroarea_pk is NULL) or located in a macroarea.
+    """
+    languoid_pk = Column(Integer, ForeignKey('languoid.pk'), index=True)
+    macroarea_pk = Column(Integer, ForeignKey('macroarea.pk'))
+    level = Column(LanguoidLevel.db_type())
+    status = Column(LanguoidStatus.db_type())
+    count = Column(Integer)
+
+    @classmethod
+    def get_counts(cls, languoid_pks=None, level=None, status=None, macroarea_pk=None,
+                   session=None):
+        """
+        :param languoid_pks: list of languoid pks or None, to count for all languoids.
+        :return: dict mapping languoid pks to the number of descendants matching the \
+        criteria.
+        """
+        query = (session or DBSession).query(cls.languoid_pk, func.sum(cls.count))\
+            .group_by(cls.languoid_pk)
+        if languoid_pks is not None:
+            query = query.filter(cls.languoid_pk.in_(languoid_pks))
+        query = query.filter(cls.macroarea_pk == macroarea_pk) \
+            if macroarea_pk else query.filter(cls.macroarea_pk == None)
+        if level:
+            query = query.filter(cls.level == level)
+        if status:
+            statuses = status if isinstance(status, (list, tuple)) else [status]
+            query = query.filter(cls.status.in_(statuses))
+        res = dict((pk, 0) for pk in languoid_pks or [])
+        res.update((pk, int(n)) for pk, n in query)
+        return res
+
+
+class LanguoidListing(Base):
+    """Denormalized row per languoid, holding everything displayed in the languoid
+    listings - see glottolog3.listing.
+    """
+    languoid_pk = Column(Integer, ForeignKey('languoid.pk'), unique=True)
+    id = Column(String, index=True)
+    name = Column(Unicode, index=True)
+    level = Column(LanguoidLevel.db_type())
+    status = Column(LanguoidStatus.db_type())
+    # one of 'Top-level family', 'Isolate', 'Subfamily':
+    level_label = Column(Unicode)
+    father_pk = Column(Integer)
+    family_id = Column(String)
+    family_name = Column(Unicode, index=True)
+    iso_code = Column(Unicode)
+    macroarea_pks = Column(ARRAY(Integer))
+    macroareas = Column(Unicode)
+    child_family_count = Column(Integer)
+    child_language_count = Column(Integer)
+    child_dialect_count = Column(Integer)
+
+
+Index(
+    'ix_languoidlisting_macroarea_pks',
+    LanguoidListing.__table__.c.macroarea_pks,
+    postgresql_using='gin')
+
+
 class TreeClosureTable(Base):
     __table_args__ = (UniqueConstraint('parent_pk', 'child_pk'),)
     parent_pk = Column(Integer, ForeignKey('languoid.pk'))
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks comparing alternative query strategies against the configured database.
+
+    python glottolog3/scripts/benchmark.py development.ini [benchmark ...]
+"""
+import os
+import sys
+import time
+import json
+import resource
+from collections import OrderedDict
+
+import transaction
+from path import path
+from sqlalchemy import tuple_
+from clld.scripts.util import parsed_args
+from clld.db.meta import DBSession
+from clld.db.models.common import LanguageSource
+from clld.db.util import icontains
+
+import glottolog3
+from glottolog3.models import (
+    Languoid, Ref, Doctype, Macroarea, Refdoctype, Refmacroarea,
+)
+from glottolog3.legacy import LegacyCodes, build
+from glottolog3.util import descendants, getRefs
+from glottolog3.autocomplete import AutocompleteIndex
+from glottolog3.datatables import REF_SORT_KEY, RefBookmarks
+
+
+BENCHMARKS = OrderedDict()
+
+# families of different sizes:
+FAMILIES = ['aust1307', 'indo1319', 'atla1278', 'sino1245', 'ural1272']
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def timeit(label, func, repeat=5):
+    """run func repeatedly and print the best and mean time.
+    """
+    times = []
+    res = None
+    for i in range(repeat):
+        start = time.time()
+        res = func()
+        times.append(time.time() - start)
+    print '%-50s %10.1fms %10.1fms  %s' % (
+        label, min(times) * 1000, sum(times) * 1000 / len(times), res)
+    return res
+
+
+@benchmark
+def descendants_lookup(args):
+    """references of a family via closure table vs. nested intervals.
+    """
+    for gc in FAMILIES:
+        l = Languoid.get(gc, default=None)
+        if not l:
+            continue
+        for intervals in [False, True]:
+            timeit(
+                '%s refs (%s)' % (gc, 'intervals' if intervals else 'closure'),
+                lambda: DBSession.query(Ref)
+                .join(LanguageSource, LanguageSource.source_pk == Ref.pk)
+                .filter(LanguageSource.language_pk.in_(descendants([l], intervals)))
+                .distinct()
+                .count())
+
+
+@benchmark
+def autocomplete(args):
+    """languoid autocompletion via icontains query vs. in-memory index.
+    """
+    start = time.time()
+    index = AutocompleteIndex.from_db()
+    print '%-50s %10.1fms' % (
+        'build index (%s keys)' % len(index.keys), (time.time() - start) * 1000)
+    for q in ['a', 'ac', 'germ', 'Standard', 'stan1295', 'xyz']:
+        timeit(
+            '%s (query)' % q,
+            lambda: [
+                DBSession.query(Languoid.id, Languoid.name, Languoid.level)
+                .filter(icontains(Languoid.name, q)).count(),
+                len(DBSession.query(Languoid.id, Languoid.name, Languoid.level)
+                    .filter(icontains(Languoid.name, q)).limit(100).all())])
+        timeit('%s (index)' % q, lambda: index.search(q)[1])
+
+
+@benchmark
+def legacy_codes(args):
+    """legacy code lookup via JSON dict vs. memory-mapped binary file.
+    """
+    lc = path(glottolog3.__file__).dirname().joinpath('static', 'legacy_codes.json')
+    build(lc, lc + '.tmp')
+    codes = ['zulu1241', 'stan1295', '12345', '999999']
+    for label, load in [
+        ('binary', lambda: LegacyCodes(lc + '.tmp')),
+        ('json', lambda: json.load(open(lc))),
+    ]:
+        # note: maxrss is a high-water mark, thus we load the small set first.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        obj = load()
+        print '%-50s %10.1fms  maxrss +%skB' % (
+            'load %s' % label,
+            (time.time() - start) * 1000,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss)
+        timeit(
+            'lookup %s (x10000)' % label,
+            lambda: sum(1 for i in range(2500) for code in codes if code in obj))
+    os.remove(lc + '.tmp')
+
+
+# representative parameter sets of langdoc complex queries:
+REFS_PARAMS = [
+    dict(languoids=['cher1273'], macroareas=['northamerica'], doctypes=['grammar'],
+         biblio=dict(author='King')),
+    dict(languoids=['indo1319'], doctypes=['grammar']),
+    dict(macroareas=['africa'], doctypes=['dictionary']),
+    dict(biblio=dict(title='grammar')),
+]
+
+
+def _refs_params(spec):
+    params = dict(biblio=spec.get('biblio', {}))
+    for name, model in [
+            ('languoids', Languoid), ('doctypes', Doctype), ('macroareas', Macroarea)]:
+        params[name] = filter(
+            None, [model.get(id_, default=None) for id_ in spec.get(name, [])])
+    return params
+
+
+def _joined_refs(params):
+    """the former implementation of getRefs, joining associations and selecting DISTINCT.
+    """
+    query = DBSession.query(Ref)
+    for param, value in params['biblio'].items():
+        if value:
+            query = query.filter(icontains(getattr(Ref, param), value))
+    if params.get('languoids'):
+        query = query.join(LanguageSource, LanguageSource.source_pk == Ref.pk)\
+            .filter(LanguageSource.language_pk.in_(descendants(params['languoids'])))
+    if params.get('doctypes'):
+        query = query.join(Refdoctype)\
+            .filter(Refdoctype.doctype_pk.in_([l.pk for l in params['doctypes']]))
+    if params.get('macroareas'):
+        query = query.join(Refmacroarea)\
+            .filter(Refmacroarea.macroarea_pk.in_([l.pk for l in params['macroareas']]))
+    return query.distinct()
+
+
+def _explain(query):
+    sql = query.statement.compile(
+        dialect=DBSession.bind.dialect, compile_kwargs=dict(literal_binds=True))
+    for row in DBSession.execute('EXPLAIN %s' % sql):
+        print '    %s' % row[0]
+
+
+@benchmark
+def refs_query(args):
+    """complex query for references via joins and DISTINCT vs. semi-joins on pk.
+    """
+    for spec in REFS_PARAMS:
+        params = _refs_params(spec)
+        label = ' '.join('%s=%s' % item for item in sorted(spec.items()))
+        for name, query in [
+            ('joins', _joined_refs(params)),
+            ('semi-joins', getRefs(params)),
+        ]:
+            print '%s (%s):' % (label, name)
+            _explain(query)
+            timeit('%s (%s)' % (label[:30], name), query.count)
+
+
+@benchmark
+def refs_pages(args):
+    """pages of the refs listing via OFFSET vs. seeking past bookmarks.
+    """
+    start = time.time()
+    bookmarks = RefBookmarks.from_db()
+    print '%-50s %10.1fms' % (
+        'build bookmarks (%s)' % len(bookmarks.keys), (time.time() - start) * 1000)
+    size = 100
+    for page in [1, 50, 5000]:
+        offset = (page - 1) * size
+        query = DBSession.query(Ref).order_by(*REF_SORT_KEY)
+        timeit(
+            'page %s (offset)' % page,
+            lambda: len(query.offset(offset).limit(size).all()))
+
+        def seek():
+            key, rel_offset = bookmarks.seek(offset)
+            q = query if key is None \
+                else query.filter(tuple_(*REF_SORT_KEY) > tuple_(*key))
+            return len(q.offset(rel_offset).limit(size).all())
+
+        timeit('page %s (keyset)' % page, seek)
+
+
+def main(args):  # pragma: no cover
+    with transaction.manager:
+        for name in args.benchmarks or BENCHMARKS.keys():
+            print '--- %s: %s' % (name, BENCHMARKS[name].__doc__.strip())
+            BENCHMARKS[name](args)
+
+
+if __name__ == '__main__':
+    main(parsed_args((("benchmarks",), dict(nargs='*', help='|'.join(BENCHMARKS.keys())))))
+    sys.exit(0)
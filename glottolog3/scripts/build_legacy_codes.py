@@ -0,0 +1,15 @@
+"""
+Build static/legacy_codes.bin from static/legacy_codes.json - see glottolog3.legacy.
+"""
+import sys
+
+from path import path
+
+import glottolog3
+from glottolog3.legacy import build
+
+
+if __name__ == '__main__':
+    static = path(glottolog3.__file__).dirname().joinpath('static')
+    build(static.joinpath('legacy_codes.json'), static.joinpath('legacy_codes.bin'))
+    sys.exit(0)
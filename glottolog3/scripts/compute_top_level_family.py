@@ -1,23 +1,29 @@
 # -*- coding: utf-8 -*-
+"""
+Set Languoid.family according to the closure table.
+
+With option --check, languoids with inconsistent top-level family are only reported,
+and the script exits with status 1 if there are any.
+"""
 import sys
 import transaction
 
 from clld.scripts.util import parsed_args
-from clld.db.meta import DBSession
 
-from glottolog3.models import Languoid
+from glottolog3.tree import get_family_mismatches, update_family
 
 
 def main(args):  # pragma: no cover
     with transaction.manager:
-        for l in DBSession.query(Languoid).filter(Languoid.father_pk != None):
-            family = None
-            for ll in l.get_ancestors():
-                family = ll
-            if family:
-                l.family = family
+        if args.check:
+            mismatches = get_family_mismatches()
+            for pk, family_pk, expected in mismatches:
+                print '%s: family %s, expected %s' % (pk, family_pk, expected)
+            print '%s mismatches' % len(mismatches)
+            return len(mismatches)
+        print '%s languoids updated' % update_family()
+        return 0
 
 
 if __name__ == '__main__':
-    main(parsed_args())
-    sys.exit(0)
+    sys.exit(1 if main(parsed_args((("--check",), dict(action="store_true")))) else 0)
@@ -19,6 +19,9 @@ from glottolog3.models import (
     Ref, Provider, Refprovider, Macroarea, Doctype, Country, Languoid,
 )
 from glottolog3.lib.util import get_map
+from glottolog3.fts import update_fts
+from glottolog3.stats import update_statistics
+from glottolog3.cache import bump_data_version
 
 # id
 # bibtexkey
@@ -204,6 +207,7 @@ CODE_PATTERN = re.compile('\[(?P<code>[^\]]+)\]')
 def main(bib, mode):  # pragma: no cover
     count = 0
     skipped = 0
+    pks = []
 
     with transaction.manager:
         provider_map = get_map(Provider)
@@ -365,12 +369,21 @@ def main(bib, mode):  # pragma: no cover
                 #
                 DBSession.add(ref)
 
+            pks.append(id_)
+
             if i % 100 == 0:
                 print i, 'records done'
 
             if changed:
                 count += 1
 
+        DBSession.flush()
+        update_fts(pks)
+        # refresh the snapshots of reference counts and mark the per-worker caches as
+        # stale:
+        update_statistics()
+        bump_data_version()
+
         print count, 'records updated or imported'
         print skipped, 'records skipped because of lack of information'
 
@@ -6,7 +6,6 @@ import json
 
 import transaction
 from sqlalchemy import create_engine
-from sqlalchemy import sql
 from path import path
 
 from clld.scripts.util import initializedb, Data
@@ -17,6 +16,11 @@ from clld.lib import dsv
 from clld.lib.bibtex import EntryType
 
 from glottolog3 import models as models2
+from glottolog3 import tree
+from glottolog3.cache import bump_data_version
+from glottolog3.stats import update_statistics
+from glottolog3.fts import update_fts
+from glottolog3.listing import update_listing
 from glottolog2.lib.util import glottocode, REF_PATTERN
 
 
@@ -327,33 +331,36 @@ def create(args):
 
 
 def prime_cache(args):
-    DBSession.execute('delete from treeclosuretable')
-    SQL = models2.TreeClosureTable.__table__.insert()
-    ltable = models2.Languoid.__table__
-
-    # we compute the ancestry for each single languoid
-    for lid, fid in DBSession.execute('select pk, father_pk from languoid').fetchall():
-        depth = 0
-        DBSession.execute(SQL, dict(child_pk=lid, parent_pk=lid, depth=depth))
-
-        # now follow up the line of ancestors
-        while fid:
-            depth += 1
-            DBSession.execute(SQL, dict(child_pk=lid, parent_pk=fid, depth=depth))
-            fid = DBSession.execute(
-                sql.select([ltable.c.father_pk]).where(ltable.c.pk == fid)
-            ).fetchone()[0]
+    # we compute the ancestry for all languoids in one pass over the tree:
+    tree.rebuild_closure()
+    tree.update_family()
 
     # we also pre-compute counts of descendants for each languoid:
-    for level in ['language', 'dialect', 'family']:
-        DBSession.execute("""\
-UPDATE languoid SET child_%(level)s_count = (
-    SELECT count(*)
-    FROM treeclosuretable as t, languoid as l
-    WHERE languoid.pk = t.parent_pk
-    AND languoid.pk != t.child_pk AND t.child_pk = l.pk AND l.level = '%(level)s'
-)""" % locals())
+    tree.update_counts()
 
+    # and the nested intervals for range queries of descendants:
+    tree.update_intervals()
+
+    # and the line of ancestors, to render the classification without walking the tree:
+    tree.update_ancestry()
+
+    # and the effective subclassification justifications:
+    tree.update_screfs()
+
+    # and the coordinates of descendants for the maps:
+    tree.update_geocoords()
+
+    # the denormalized rows of the languoid listings:
+    update_listing()
+
+    # the search documents for the full-text search of references:
+    update_fts()
+
+    # snapshot of the figures on the glottolog information page:
+    update_statistics()
+
+    # finally we mark the per-worker caches as stale:
+    bump_data_version()
     DBSession.execute('COMMIT')
 
 
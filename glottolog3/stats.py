@@ -0,0 +1,119 @@
+"""
+Snapshots of figures computed from the data, stored in the Statistics table.
+
+Snapshots are computed by prime_cache - curator migrations compute them with a copy
+of the queries in SQL, see migrations/curator.py. Functions accept an optional session
+argument, defaulting to DBSession.
+"""
+from sqlalchemy import or_, desc
+from sqlalchemy.sql.expression import func
+from clld.db.meta import DBSession
+from clld.db.models.common import Language, Source
+
+from glottolog3.models import (
+    Languoid, LanguoidStatus, LanguoidLevel, Macroarea, Languoidmacroarea, Statistics,
+    Provider, Refprovider,
+)
+from glottolog3.cache import VersionedCache
+
+
+def get_statistics(id_, session=None):
+    """
+    :return: the data of the snapshot id_ or None.
+    """
+    res = (session or DBSession).query(Statistics.data)\
+        .filter(Statistics.id == id_).first()
+    return res[0] if res else None
+
+
+def set_statistics(id_, data, session=None):
+    session = session or DBSession
+    stats = session.query(Statistics).filter(Statistics.id == id_).first()
+    if not stats:
+        stats = Statistics(id=id_)
+        session.add(stats)
+    stats.data = data
+    session.flush()
+
+
+def compute_glottolog_statistics(session=None):
+    """
+    :return: dict with the numbers of families, isolates and languages - in total and\
+    per macroarea.
+    """
+    session = session or DBSession
+    q = session.query(Languoid)\
+        .filter(Language.active == True)\
+        .filter(or_(Languoid.status == LanguoidStatus.established,
+                    Languoid.status == LanguoidStatus.unattested))
+    qt = q.filter(Languoid.father_pk == None)
+    qf = qt.filter(Languoid.level == LanguoidLevel.family)
+    qi = qt.filter(Languoid.level == LanguoidLevel.language)
+    ql = q.filter(Languoid.hid != None)
+    res = {
+        'last_update': '%s' % session.query(Language.updated)
+        .order_by(desc(Language.updated)).first()[0],
+        'number_of_families': qf.count(),
+        'number_of_isolates': qi.count(),
+    }
+    res['number_of_languages'] = {
+        'all': ql.count(),
+        'pidgin': qt.filter(Language.name == 'Pidgin').one().child_language_count,
+        'artificial': qt.filter(Language.name == 'Artificial Language').one().child_language_count,
+        'sign': sum(l.child_language_count for l in qt.filter(Language.name.contains('Sign '))),
+    }
+    res['number_of_languages']['l1'] = res['number_of_languages']['all'] \
+        - res['number_of_languages']['pidgin']\
+        - res['number_of_languages']['artificial']\
+        - res['number_of_languages']['sign']
+
+    macroareas = dict(session.query(Macroarea.pk, Macroarea.id))
+    res['macroareas'] = dict((id_, {
+        'number_of_families': 0,
+        'number_of_isolates': 0,
+        'number_of_languages': 0}) for id_ in macroareas.values())
+    for key, query in [
+        ('number_of_families', qf),
+        ('number_of_isolates', qi),
+        ('number_of_languages', ql),
+    ]:
+        for pk, n in query\
+                .join(Languoidmacroarea, Languoidmacroarea.languoid_pk == Languoid.pk)\
+                .with_entities(Languoidmacroarea.macroarea_pk, func.count(Languoid.pk))\
+                .group_by(Languoidmacroarea.macroarea_pk):
+            res['macroareas'][macroareas[pk]][key] = n
+    return res
+
+
+def compute_provider_statistics(session=None):
+    """
+    :return: dict with the numbers of refs per provider pk and the total numbers of refs\
+    and languoids.
+    """
+    session = session or DBSession
+    return {
+        'ref_count': dict(
+            ('%s' % pk, n) for pk, n in
+            session.query(Provider.pk, func.count(Refprovider.ref_pk))
+            .filter(Provider.pk == Refprovider.provider_pk)
+            .group_by(Provider.pk)),
+        'totalrefs': session.query(Source).count(),
+        'totalnodes': session.query(Language).count(),
+    }
+
+
+def get_provider_statistics():
+    res = get_statistics('providers') or compute_provider_statistics()
+    # JSON objects are keyed by strings:
+    res['ref_count'] = dict((int(pk), n) for pk, n in res['ref_count'].items())
+    return res
+
+
+provider_statistics = VersionedCache(get_provider_statistics)
+
+
+def update_statistics(session=None):
+    set_statistics(
+        'glottolog', compute_glottolog_statistics(session=session), session=session)
+    set_statistics(
+        'providers', compute_provider_statistics(session=session), session=session)
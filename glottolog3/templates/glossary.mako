@@ -18,7 +18,7 @@
     </dd>
     <dt id="Doctype"> Document type</dt>
     <dd>
-        The class a document belongs to. There are ${doctypes.count()} classes.
+        The class a document belongs to. There are ${len(doctypes)} classes.
         document can belong to more than one class.
         The following doctypes are distinguished
         <dl>
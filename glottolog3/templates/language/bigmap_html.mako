@@ -11,7 +11,7 @@
 </%block>
 
 <ul class="breadcrumb">
-    % for l in reversed(list(ctx.get_ancestors())):
+    % for l in ctx.get_ancestry():
     <li>${h.link(request, l)} <span class="divider">/</span></li>
     % endfor
     <li class="active">${h.link(request, ctx)}</li>
@@ -10,6 +10,8 @@
     <link  rel="alternate" type="text/n3" href="${request.resource_url(ctx, ext='n3')}" title="Structured Descriptor Document (n3 format)"/>
 </%block>
 
+<%def name="cached(section)">${u.fragment(request, ctx, section, lambda: capture(caller.body))|n}</%def>
+
 <%def name="nodes(tree, level)">
     <% item = tree[level] %>
     <ul>
@@ -55,9 +57,11 @@
 <div class="row-fluid">
     <div class="span8">
         <h3>${ctx} ${h.contactmail(req, ctx, title='report a problem')}</h3>
+        <%self:cached section="tree">
         % if ctx.active:
+        <% u.load_tree_classifications(ctx) %>
         <div class="treeview well well-small">
-            ${nodes(list(reversed([ctx] + list(ctx.get_ancestors()))), 0)}
+            ${nodes(ctx.get_ancestry() + [ctx], 0)}
         </div>
         <script>
         $(document).ready(function() {
@@ -81,6 +85,7 @@
             </ul>
         </div>
         % endif
+        </%self:cached>
 
         % if ctx.status and ctx.status != u.LanguoidStatus.established:
         <div class="alert">
@@ -88,6 +93,7 @@
         </div>
         % endif
 
+        <%self:cached section="classification">
         % if ctx.fc or ctx.sc or ctx.crefs:
         <div class="alert alert-success">
             <button type="button" class="close" data-dismiss="alert">&times;</button>
@@ -104,6 +110,7 @@
             % endif
         </div>
         % endif
+        </%self:cached>
     </div>
 
     <div class="span4">
@@ -114,6 +121,7 @@
             % endif
         </div>
         <div class="accordion" id="sidebar-accordion" style="margin-top: 1em; clear: right;">
+            <%self:cached section="sidebar">
             % if request.map:
             <%util:accordion_group eid="acc-map" parent="sidebar-accordion" title="Map" open="${True}">
                 ${request.map.render()}
@@ -148,6 +156,7 @@
                 % endfor
                 </dl>
             </%util:accordion_group>
+            </%self:cached>
         </div>
     </div>
 </div>
@@ -156,7 +165,9 @@
     <div class="span12">
     <h4>References</h4>
 % if ctx.child_language_count < 500:
+    <%self:cached section="refs">
     ${request.get_datatable('sources', h.models.Source, language=ctx).render()}
+    </%self:cached>
 % else:
     <div class="alert alert-block">
         This family has more than 500 languages. Please select an appropriate sub-family to get a list of relevant references.
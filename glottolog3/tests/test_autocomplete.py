@@ -0,0 +1,34 @@
+# coding: utf8
+from __future__ import unicode_literals
+from unittest import TestCase
+
+
+class Tests(TestCase):
+    def test_AutocompleteIndex(self):
+        from glottolog3.autocomplete import AutocompleteIndex
+
+        index = AutocompleteIndex(
+            [
+                (1, 'stan1295', 'Standard German', 'language'),
+                (2, 'germ1287', 'German', 'family'),
+                (3, 'bern1235', 'Bernese German', 'dialect'),
+                (4, 'gali1258', 'Galician', 'language'),
+            ],
+            [
+                (1, 'Standard German'), (1, 'stan1295'), (1, 'deu'), (1, 'Deutsch'),
+                (2, 'German'), (2, 'germ1287'),
+                (3, 'Bernese German'), (3, 'Bärndütsch'),
+                (4, 'Galician'), (4, 'Galego'),
+            ])
+        matches, total = index.search('german')
+        self.assertEqual(total, 3)
+        # exact before infix matches, languages before dialects:
+        self.assertEqual([m.id for m in matches], ['germ1287', 'stan1295', 'bern1235'])
+        self.assertEqual(index.search('DEU')[0][0].id, 'stan1295')
+        self.assertEqual(index.search('barnd')[0][0].id, 'bern1235')
+        self.assertEqual(index.search('ga')[1], 1)
+        self.assertEqual(index.search('g')[1], 4)
+        self.assertEqual(index.search('q')[1], 0)
+        self.assertEqual(index.search('an', limit=2)[1], 4)
+        self.assertEqual(len(index.search('an', limit=2)[0]), 2)
+        self.assertEqual(index.search(''), ([], 0))
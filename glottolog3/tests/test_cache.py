@@ -0,0 +1,58 @@
+from unittest import TestCase
+
+
+class Tests(TestCase):
+    def setUp(self):
+        from glottolog3 import cache
+
+        self.version = 1
+        self._get = cache.data_version.get
+        cache.data_version.get = lambda: self.version
+
+    def tearDown(self):
+        from glottolog3 import cache
+
+        cache.data_version.get = self._get
+
+    def test_FragmentCache(self):
+        from glottolog3.cache import FragmentCache
+
+        fc = FragmentCache(maxsize=1000)
+        self.assertEqual(fc.get(1, lambda: 'a' * 100), 'a' * 100)
+        self.assertEqual(fc.get(1, lambda: 'b'), 'a' * 100)
+        self.assertEqual((fc.hits, fc.misses), (1, 1))
+
+        # least recently used fragments are evicted:
+        fc.get(2, lambda: 'b' * 300)
+        fc.get(1, lambda: 'x')
+        fc.get(3, lambda: 'c' * 500)
+        self.assertEqual(set(fc.fragments.keys()), set([1, 3]))
+        self.assertTrue(fc.size <= fc.maxsize)
+
+        # fragments exceeding the memory cap are not cached:
+        fc.get(4, lambda: 'd' * 2000)
+        self.assertFalse(4 in fc.fragments)
+
+        # fragments are invalidated when the data version changes:
+        self.version = 2
+        self.assertEqual(fc.get(1, lambda: 'y'), 'y')
+        self.assertEqual(list(fc.fragments.keys()), [1])
+
+    def test_CountCache(self):
+        from glottolog3.cache import CountCache
+
+        cc = CountCache(maxsize=2, ttl=60)
+        self.assertEqual(cc.get('a', lambda: 1), 1)
+        self.assertEqual(cc.get('a', lambda: 2), 1)
+        cc.get('b', lambda: 3)
+        cc.get('c', lambda: 4)
+        self.assertEqual(list(cc.counts.keys()), ['b', 'c'])
+
+        # expired counts are recomputed:
+        cc.ttl = -1
+        self.assertEqual(cc.get('b', lambda: 5), 5)
+        self.assertEqual((cc.hits, cc.misses), (1, 4))
+
+        cc.ttl = 60
+        self.version = 2
+        self.assertEqual(cc.get('c', lambda: 6), 6)
@@ -0,0 +1,14 @@
+# coding: utf8
+from unittest import TestCase
+
+
+class Tests(TestCase):
+    def test_tsquery(self):
+        from glottolog3.fts import tsquery
+
+        self.assertEqual(tsquery('King'), 'king:*')
+        self.assertEqual(
+            tsquery(u'Grammar of  Yélî-Dnye'), u'grammar:* & of:* & yélî:* & dnye:*')
+        self.assertEqual(tsquery("O'Brien"), 'o:* & brien:*')
+        self.assertEqual(tsquery("1998"), '1998:*')
+        self.assertEqual(tsquery(' & ! '), None)
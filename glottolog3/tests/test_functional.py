@@ -1,8 +1,12 @@
 from path import path
+import transaction
 
 from clld.tests.util import TestWithApp
+from clld.db.meta import DBSession
 
 import glottolog3
+from glottolog3.models import Ref, Macroarea
+from glottolog3.datatables import REF_SORT_KEY
 
 
 class Tests(TestWithApp):
@@ -29,18 +33,60 @@ class Tests(TestWithApp):
     def test_languoidsfamily(self):
         res = self.app.get('/glottolog/family?sEcho=1', xhr=True, status=200)
         res = self.app.get('/glottolog/family', accept='text/html', status=200)
+        # child counts restricted to a macroarea:
+        res = self.app.get(
+            '/glottolog?type=families&sEcho=1&iSortingCols=1&iSortCol_0=4&sSortDir_0=desc'
+            '&sSearch_2=%s' % DBSession.query(Macroarea).first().pk,
+            xhr=True,
+            status=200)
+        counts = [int(row[4]) for row in res.json['aaData']]
+        assert counts == sorted(counts, reverse=True)
 
     def test_languoidslanguage(self):
         res = self.app.get('/glottolog/language?sEcho=1', xhr=True, status=200)
+        res = self.app.get(
+            '/glottolog/language?sEcho=1&iSortingCols=1&iSortCol_0=2&sSortDir_0=asc&sSearch_2=indo',
+            xhr=True,
+            status=200)
         res = self.app.get('/glottolog/language', accept='text/html', status=200)
 
     def test_languoidsmeta(self):
         res = self.app.get('/glottolog/glottologinformation', status=200)
         res = self.app.get('/glottolog/glottologinformation', accept='text/html', status=200)
+        res = self.app.get('/glottolog/glottologinformation.json', status=200)
+        assert 'macroareas' in res.json
 
     def test_langdoc(self):
         res = self.app.get('/langdoc', status=200)
         res = self.app.get('/langdoc', accept='text/html', status=200)
+        res = self.app.get(
+            '/langdoc?sEcho=1&iDisplayStart=2500&iDisplayLength=100', xhr=True, status=200)
+        assert len(res.json['aaData']) == 100
+
+        # the page looked up via bookmarks is the page selected with OFFSET:
+        refs = DBSession.query(Ref).filter(Ref.active == True)\
+            .order_by(*REF_SORT_KEY).offset(2500).limit(100)
+        for ref, row in zip(refs, res.json['aaData']):
+            assert '/resource/reference/id/%s"' % ref.id in '%s' % row
+
+    def test_langdoc_inactive(self):
+        from glottolog3.datatables import Refs, ref_bookmarks
+
+        # inactive refs before and between the bookmarks must not shift the pages:
+        for ref in DBSession.query(Ref).order_by(*REF_SORT_KEY).limit(2500)[::250]:
+            ref.active = False
+        DBSession.flush()
+        ref_bookmarks.refresh()
+        try:
+            self.set_request_properties(params={
+                'sEcho': '1', 'iDisplayStart': '2500', 'iDisplayLength': '100'})
+            dt = Refs(self.env['request'], Ref)
+            refs = DBSession.query(Ref).filter(Ref.active == True)\
+                .order_by(*REF_SORT_KEY).offset(2500).limit(100)
+            assert [ref.pk for ref in dt.get_query()] == [ref.pk for ref in refs]
+        finally:
+            transaction.abort()
+            ref_bookmarks.refresh()
 
     def test_langdocmeta(self):
         res = self.app.get('/langdoc/langdocinformation', status=200)
@@ -51,16 +97,55 @@ class Tests(TestWithApp):
         res = self.app.get('/langdoc/complexquery?languoids=guac1239', status=200)
         res = self.app.get('/langdoc/complexquery?languoids=guac1239&format=xls', status=406)
         res = self.app.get('/langdoc/complexquery?languoids=guac1239&format=bib', status=200)
+        assert '@' in res.body
+        assert res.content_type == 'text/x-bibtex'
+        assert 'Content-Encoding' not in res.headers
+        res = self.app.get(
+            '/langdoc/complexquery?languoids=guac1239&format=bib',
+            headers={'Accept-Encoding': 'gzip'},
+            status=200)
+        assert res.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in res.headers['Vary']
+        res = self.app.get(
+            '/langdoc/complexquery?languoids=guac1239&format=bib',
+            headers={'Accept-Encoding': 'gzip;q=0, identity'},
+            status=200)
+        assert 'Content-Encoding' not in res.headers
         res = self.app.get('/langdoc/complexquery?languoids=cher1273&macroareas=northamerica&doctypes=grammar&author=King', status=200)
+        res = self.app.get('/langdoc/complexquery?title=grammar+of&year=19', status=200)
+
+    def test_langdoccomplexquery_vocabularies(self):
+        res = self.app.get(
+            '/langdoc/complexquery?macroareas=northamerica&macroareas=eurasia'
+            '&doctypes=grammar&doctypes=grammar_sketch',
+            accept='text/html',
+            status=200)
+        # the multiselects list all terms and the selected ones with their labels:
+        assert '"North America"' in res
+        assert '"Grammar Sketch"' in res
 
     def test_childnodes(self):
         res = self.app.get('/db/getchildlects?q=ac', status=200)
         res = self.app.get('/db/getchildlects?node=1234', status=200)
         res = self.app.get('/db/getchildlects?t=select2&q=ac', status=200)
+        res = self.app.get('/db/getchildlects', status=200)
+        self.app.get(
+            '/db/getchildlects',
+            headers={'If-None-Match': res.headers['ETag']},
+            status=304)
+
+    def test_cachestats(self):
+        self.app.get('/resource/languoid/id/stan1295', accept='text/html', status=200)
+        self.app.get('/glottolog/family?sEcho=1', xhr=True, status=200)
+        res = self.app.get('/db/cachestats', status=200)
+        assert res.json['fragments']['hits'] + res.json['fragments']['misses'] > 0
+        assert res.json['counts']['hits'] + res.json['counts']['misses'] > 0
 
     def test_iso(self):
         res = self.app.get('/resource/languoid/iso/deu.rdf', status=302)
         res = self.app.get('/resource/languoid/iso/xxxx', status=404)
+        res = self.app.get('/resource/languoid/iso?codes=deu,xxxx', status=200)
+        assert res.json['deu'] and res.json['xxxx'] is None
 
     def test_legacy(self):
         res = self.app.get('/resource/languoid/id/zulu1241', status=410)
@@ -71,7 +156,21 @@ class Tests(TestWithApp):
         res = self.app.get('/resource/languoid/id/stan1295', accept='text/html', status=200)
         res = self.app.get('/resource/languoid/id/nilo1235', accept='text/html', status=200)
         res = self.app.get('/resource/languoid/id/stan1295.bigmap.html', accept='text/html', status=200)
+        self.app.get(
+            '/resource/languoid/id/stan1295.bigmap.html',
+            accept='text/html',
+            headers={'If-None-Match': res.headers['ETag']},
+            status=304)
+        self.app.get(
+            '/resource/languoid/id/stan1295.rdf',
+            headers={'If-None-Match': res.headers['ETag']},
+            status=200)
 
     def test_ref(self):
         res = self.app.get('/resource/reference/id/2.rdf', status=200)
         res = self.app.get('/resource/reference/id/2', accept='text/html', status=200)
+        self.app.get(
+            '/resource/reference/id/2',
+            accept='text/html',
+            headers={'If-Modified-Since': res.headers['Last-Modified']},
+            status=304)
@@ -0,0 +1,29 @@
+import os
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_LegacyCodes(self):
+        from glottolog3.legacy import LegacyCodes
+
+        codes = ['2', '3', '17', '104360', 'muni1242', 'zulu1241']
+        src = os.path.join(self.tmp, 'codes.json')
+        with open(src, 'w') as fp:
+            json.dump(dict((code, 1) for code in codes), fp)
+
+        lc = LegacyCodes.from_json(src)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, 'codes.bin')))
+        self.assertEqual(len(lc), len(codes))
+        for code in codes:
+            self.assertTrue(code in lc)
+        for code in ['1', '017', '104361', '999999', 'stan1295', 'zulu124', '']:
+            self.assertFalse(code in lc)
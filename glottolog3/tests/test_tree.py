@@ -0,0 +1,79 @@
+from unittest import TestCase
+
+
+# a small tree: 1 -> 2 -> 3 -> 4, 2 -> 5, 6 (isolate), 7 -> 8
+FATHERS = {1: None, 2: 1, 3: 2, 4: 3, 5: 2, 6: None, 7: None, 8: 7}
+
+
+def legacy_closure(fathers):
+    """the closure as computed by following the line of ancestors for each languoid.
+    """
+    res = set()
+    for lid, fid in fathers.items():
+        depth = 0
+        res.add((lid, lid, depth))
+        while fid:
+            depth += 1
+            res.add((lid, fid, depth))
+            fid = fathers[fid]
+    return res
+
+
+class Tests(TestCase):
+    def test_closure(self):
+        from glottolog3.tree import iter_closure
+
+        rows = list(iter_closure(FATHERS))
+        self.assertEqual(len(rows), len(set(rows)))
+        self.assertEqual(set(rows), legacy_closure(FATHERS))
+
+    def test_lineages(self):
+        from glottolog3.tree import get_lineages
+
+        lineages = get_lineages(FATHERS)
+        self.assertEqual(lineages[4], (4, 3, 2, 1))
+        self.assertEqual(lineages[6], (6,))
+
+    def test_cycle(self):
+        from glottolog3.tree import get_lineages
+
+        self.assertRaises(ValueError, get_lineages, {1: 2, 2: 1})
+
+    def test_moved(self):
+        from glottolog3.tree import moved
+
+        fathers = dict(FATHERS)
+        fathers.update({3: 7, 9: 8})
+        self.assertEqual(moved(FATHERS, fathers), set([3, 9]))
+
+    def test_TreeIndex(self):
+        from glottolog3.tree import TreeIndex
+
+        index = TreeIndex([
+            (pk, father_pk, 'family', 'established', 'n%s' % pk, 'id%s' % pk)
+            for pk, father_pk in FATHERS.items()])
+        self.assertEqual(len(index), len(FATHERS))
+        self.assertEqual(index.ancestors(4), [3, 2, 1])
+        self.assertEqual(index.ancestors(1), [])
+        self.assertEqual(index.children(2), [3, 5])
+        self.assertEqual(sorted(index.descendants(1)), [2, 3, 4, 5])
+        self.assertTrue(index.is_descendant(4, 2))
+        self.assertFalse(index.is_descendant(2, 4))
+        self.assertFalse(index.is_descendant(8, 1))
+        self.assertEqual(index.get_depth(4), 3)
+        self.assertEqual(index.top_level(5), 1)
+        self.assertEqual(index.top_level(1), None)
+        self.assertEqual(index.father_pk(8), 7)
+
+    def test_intervals(self):
+        from glottolog3.tree import TreeIndex
+
+        index = TreeIndex([
+            (pk, father_pk, 'family', 'established', 'n%s' % pk, 'id%s' % pk)
+            for pk, father_pk in FATHERS.items()])
+        intervals = dict(index.intervals())
+        for pk in FATHERS:
+            lft, rgt = intervals[pk]
+            self.assertEqual(
+                sorted(p for p, (l, r) in intervals.items() if lft < l <= rgt),
+                sorted(index.descendants(pk)))
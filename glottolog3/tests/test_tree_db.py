@@ -0,0 +1,112 @@
+from collections import Counter, defaultdict
+
+from path import path
+
+from clld.tests.util import TestWithApp
+from clld.db.meta import DBSession
+
+import glottolog3
+
+
+def expected_counts(db, pks):
+    """
+    :return: Counter of descendants of the languoids pks, keyed by triples \
+    (pk, macroarea_pk, level), where macroarea_pk is None for the total.
+    """
+    from glottolog3.tree import get_fathers, get_lineages
+
+    levels = dict(db.execute('select pk, level from languoid').fetchall())
+    macroareas = defaultdict(set)
+    for pk, macroarea_pk in db.execute(
+            'select languoid_pk, macroarea_pk from languoidmacroarea'):
+        macroareas[pk].add(macroarea_pk)
+    res = Counter()
+    for pk, lineage in get_lineages(get_fathers(db)).items():
+        for parent_pk in set(lineage[1:]) & pks:
+            for macroarea_pk in [None] + list(macroareas[pk]):
+                res[(parent_pk, macroarea_pk, levels[pk])] += 1
+    return res
+
+
+class Tests(TestWithApp):
+    """Tests of the tree maintenance functions against the database.
+
+    All changes are made within a transaction which is rolled back.
+    """
+    __cfg__ = path(glottolog3.__file__).dirname().joinpath('..', 'development.ini').abspath()
+    __setup_db__ = False
+
+    def setUp(self):
+        TestWithApp.setUp(self)
+        self.db = DBSession.bind.connect()
+        self.trans = self.db.begin()
+
+    def tearDown(self):
+        self.trans.rollback()
+        self.db.close()
+        TestWithApp.tearDown(self)
+
+    def test_rebuild_closure(self):
+        from glottolog3.tree import rebuild_closure, check_closure
+
+        rebuild_closure(db=self.db)
+        self.assertEqual(check_closure(db=self.db), (set(), set()))
+
+    def assertCounts(self, pks):
+        expected = expected_counts(self.db, pks)
+        actual = Counter()
+        for row in self.db.execute(
+                'select languoid_pk, macroarea_pk, level, count from descendantcount '
+                'where languoid_pk in (%s)' % ', '.join('%d' % pk for pk in pks)):
+            actual[tuple(row[:3])] += row[3]
+        self.assertEqual(actual, expected)
+        for pk, families, languages, dialects in self.db.execute(
+                'select pk, child_family_count, child_language_count, child_dialect_count '
+                'from languoid where pk in (%s)' % ', '.join('%d' % pk for pk in pks)):
+            self.assertEqual(
+                (families, languages, dialects),
+                tuple(expected[(pk, None, level)]
+                      for level in ['family', 'language', 'dialect']))
+
+    def test_update_counts(self):
+        from glottolog3.tree import update_counts
+
+        pks = set(row[0] for row in self.db.execute(
+            'select parent_pk from treeclosuretable where depth > 1 limit 20'))
+        update_counts(db=self.db)
+        self.assertCounts(pks)
+        update_counts(pks, db=self.db)
+        self.assertCounts(pks)
+
+    def test_update_closure(self):
+        from glottolog3.tree import (
+            get_fathers, moved, update_closure, check_closure, get_family_mismatches)
+
+        # move a languoid with at least two ancestors to another top-level family:
+        pk, old_family_pk = self.db.execute(
+            'select child_pk, parent_pk from treeclosuretable as t, languoid as l '
+            'where t.parent_pk = l.pk and l.father_pk is null and t.depth > 1 '
+            'order by child_pk limit 1').fetchone()
+        family_pk = self.db.execute(
+            "select pk from languoid where father_pk is null and level = 'family' "
+            "and pk != %s order by pk limit 1" % old_family_pk).fetchone()[0]
+        old_ancestors = set(row[0] for row in self.db.execute(
+            'select parent_pk from treeclosuretable where child_pk = %s and depth > 0' % pk))
+        subtree = set(row[0] for row in self.db.execute(
+            'select child_pk from treeclosuretable where parent_pk = %s' % pk))
+
+        fathers = get_fathers(self.db)
+        self.db.execute('update languoid set father_pk = %s where pk = %s' % (family_pk, pk))
+        new_fathers = get_fathers(self.db)
+        self.assertEqual(
+            update_closure(moved(fathers, new_fathers), fathers=new_fathers, db=self.db),
+            subtree)
+
+        self.assertEqual(check_closure(new_fathers, db=self.db), (set(), set()))
+        self.assertEqual(get_family_mismatches(db=self.db), [])
+        self.assertEqual(
+            set(row[0] for row in self.db.execute(
+                'select family_pk from languoid where pk in (%s)'
+                % ', '.join('%d' % pk for pk in subtree))),
+            set([family_pk]))
+        self.assertCounts(old_ancestors | set([family_pk]))
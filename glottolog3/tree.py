@@ -0,0 +1,519 @@
+"""
+Computation and maintenance of the denormalized representations of the languoid tree,
+i.e. the TreeClosureTable, the nested intervals, the materialized ancestry, the
+effective subclassification justifications, the coordinates of descendants and the
+descendant counts, and an in-process index of the tree.
+
+All functions operate on the complete tree as read with a single query from the languoid
+table, i.e. a dict mapping languoid pks to father pks. Functions accessing the database
+accept an optional db argument - a session or connection - defaulting to DBSession.
+Curator migrations must not call them, but run the SQL copied from migrations/curator.py.
+"""
+import time
+import json
+import logging
+from array import array
+
+from sqlalchemy import bindparam
+from clld.db.meta import DBSession
+
+from glottolog3.models import Languoid
+from glottolog3.cache import VersionedCache
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = 10000
+
+
+def get_fathers(db=None):
+    """
+    :return: dict mapping pks of all languoids to the pk of their father (or None).
+    """
+    db = db or DBSession
+    return dict(db.execute('select pk, father_pk from languoid').fetchall())
+
+
+def get_lineages(fathers):
+    """
+    :param fathers: dict mapping languoid pks to father pks.
+    :return: dict mapping languoid pks to tuples (pk, father_pk, ..., top-level pk).
+    """
+    lineages = {}
+    for pk in fathers:
+        chain = []
+        while pk is not None and pk not in lineages:
+            if pk in chain:
+                raise ValueError('cycle in languoid tree at %s' % pk)
+            chain.append(pk)
+            pk = fathers[pk]
+        lineage = lineages[pk] if pk is not None else ()
+        for pk in reversed(chain):
+            lineage = (pk,) + lineage
+            lineages[pk] = lineage
+    return lineages
+
+
+def iter_closure(fathers):
+    """
+    :param fathers: dict mapping languoid pks to father pks.
+    :return: generator of (child_pk, parent_pk, depth) triples, i.e. the rows of the \
+    closure table - including the reflexive rows of depth 0.
+    """
+    for pk, lineage in get_lineages(fathers).items():
+        for depth, parent_pk in enumerate(lineage):
+            yield pk, parent_pk, depth
+
+
+def _in(pks):
+    return '(%s)' % ', '.join('%d' % pk for pk in pks)
+
+
+# rows of the closure table for the languoids selected by the condition, computed by
+# following the father_pk links upwards.
+CLOSURE = """\
+INSERT INTO treeclosuretable (active, created, updated, child_pk, parent_pk, depth)
+WITH RECURSIVE closure (child_pk, parent_pk, depth) AS (
+    SELECT pk, pk, 0 FROM languoid %s
+    UNION ALL
+    SELECT c.child_pk, l.father_pk, c.depth + 1
+    FROM closure AS c JOIN languoid AS l ON c.parent_pk = l.pk
+    WHERE l.father_pk IS NOT NULL
+)
+SELECT true, now(), now(), child_pk, parent_pk, depth FROM closure"""
+
+
+def insert_closure(pks=None, db=None):
+    """Insert the closure rows of all languoids or of those with the given pks with a
+    single INSERT ... SELECT statement.
+
+    The recursive query does not terminate on a cycle in the tree, so the tree must be
+    checked with :func:`get_lineages` before.
+
+    :return: number of rows inserted.
+    """
+    return (db or DBSession).execute(
+        CLOSURE % ('' if pks is None else 'WHERE pk IN %s' % _in(pks))).rowcount
+
+
+def rebuild_closure(db=None):
+    """Recompute the complete closure table in one pass.
+
+    :return: number of closure rows.
+    """
+    db = db or DBSession
+    start = time.time()
+    fathers = get_fathers(db)
+    # the recursive query would not terminate on a cycle:
+    get_lineages(fathers)
+    db.execute('DELETE FROM treeclosuretable')
+    n = insert_closure(db=db)
+    log.info(
+        'closure table: %s rows for %s languoids in %.2fs',
+        n, len(fathers), time.time() - start)
+    return n
+
+
+def check_closure(fathers=None, db=None):
+    """Compare the rows in the closure table with the closure computed from the tree.
+
+    :return: pair (missing, superfluous) of sets of (child_pk, parent_pk, depth) triples.
+    """
+    db = db or DBSession
+    expected = set(iter_closure(fathers or get_fathers(db)))
+    actual = set(
+        tuple(row) for row in
+        db.execute('select child_pk, parent_pk, depth from treeclosuretable'))
+    return expected - actual, actual - expected
+
+
+def moved(old_fathers, new_fathers):
+    """
+    :return: set of pks of languoids which were added or attached to a different father.
+    """
+    return set(
+        pk for pk, father_pk in new_fathers.items()
+        if pk not in old_fathers or old_fathers[pk] != father_pk)
+
+
+def update_counts(pks=None, db=None):
+    """Recompute the counts of descendants per level with one aggregating pass over the
+    closure table, and the counts per level, status and macroarea in DescendantCount.
+
+    :param pks: restrict the update to these languoids; all languoids if None.
+    """
+    db = db or DBSession
+    if pks is not None and not pks:
+        return
+    where = '' if pks is None else 'WHERE p.pk IN %s' % _in(pks)
+    db.execute("""\
+UPDATE languoid SET
+    child_family_count = c.families,
+    child_language_count = c.languages,
+    child_dialect_count = c.dialects
+FROM (
+    SELECT
+        p.pk AS pk,
+        count(CASE WHEN l.level = 'family' THEN 1 END) AS families,
+        count(CASE WHEN l.level = 'language' THEN 1 END) AS languages,
+        count(CASE WHEN l.level = 'dialect' THEN 1 END) AS dialects
+    FROM languoid AS p LEFT OUTER JOIN (
+        treeclosuretable AS t JOIN languoid AS l ON t.child_pk = l.pk AND t.depth > 0
+    ) ON t.parent_pk = p.pk
+    %(where)s
+    GROUP BY p.pk
+) AS c
+WHERE languoid.pk = c.pk""" % locals())
+
+    db.execute('DELETE FROM descendantcount%s' % (
+        '' if pks is None else ' WHERE languoid_pk IN %s' % _in(pks)))
+    where = '' if pks is None else 'AND t.parent_pk IN %s' % _in(pks)
+    # the totals are stored with macroarea_pk NULL, which must not be a GROUP BY term:
+    for macroarea, join, group in [
+        ('NULL', '', ''),
+        (
+            'm.macroarea_pk',
+            'JOIN languoidmacroarea AS m ON m.languoid_pk = l.pk',
+            ', m.macroarea_pk'),
+    ]:
+        db.execute("""\
+INSERT INTO descendantcount
+    (active, created, updated, languoid_pk, macroarea_pk, level, status, count)
+SELECT true, now(), now(), t.parent_pk, %(macroarea)s, l.level, l.status, count(*)
+FROM treeclosuretable AS t JOIN languoid AS l ON t.child_pk = l.pk %(join)s
+WHERE t.depth > 0 %(where)s
+GROUP BY t.parent_pk, l.level, l.status%(group)s""" % locals())
+
+
+def update_closure(pks, fathers=None, db=None):
+    """Rewrite closure rows and descendant counts for the subtrees below moved languoids,
+    and the top-level families and nested intervals affected by the move.
+
+    Must be called after the father_pk of the languoids pks has been changed, but before
+    the closure table has been touched, because the affected subtrees and the former
+    ancestors are looked up in the closure table.
+
+    :param pks: pks of languoids which have been moved, see :func:`moved`.
+    :return: set of pks of languoids for which closure rows have been rewritten.
+    """
+    db = db or DBSession
+    pks = set(pks)
+    if not pks:
+        return set()
+    start = time.time()
+    fathers = fathers or get_fathers(db)
+
+    subtree = set(pks)
+    subtree.update(r[0] for r in db.execute(
+        'select child_pk from treeclosuretable where parent_pk in %s' % _in(pks)))
+    # languoids whose counts change are the ancestors before and after the move:
+    ancestors = set(r[0] for r in db.execute(
+        'select parent_pk from treeclosuretable where child_pk in %s' % _in(pks)))
+
+    lineages = get_lineages(fathers)
+    db.execute('delete from treeclosuretable where child_pk in %s' % _in(subtree))
+    insert_closure(subtree, db=db)
+    for pk in pks:
+        ancestors.update(lineages.get(pk, ()))
+    update_counts(ancestors, db=db)
+    update_family(db=db)
+    update_intervals(db=db)
+    log.info(
+        'closure table: %s languoids in %s moved subtrees updated in %.2fs',
+        len(subtree), len(pks), time.time() - start)
+    return subtree
+
+
+# pairs (pk, family_pk) where family_pk is the top-level family of the languoid computed
+# from the closure table - or NULL for top-level languoids.
+FAMILIES = """\
+SELECT l.pk AS pk, t.parent_pk AS family_pk
+FROM languoid AS l LEFT OUTER JOIN (
+    treeclosuretable AS t JOIN languoid AS f
+    ON t.parent_pk = f.pk AND f.father_pk IS NULL AND t.depth > 0
+) ON t.child_pk = l.pk"""
+
+
+def get_family_mismatches(db=None):
+    """
+    :return: list of triples (pk, family_pk, expected family_pk) for languoids with \
+    inconsistent top-level family.
+    """
+    return (db or DBSession).execute("""\
+SELECT l.pk, l.family_pk, f.family_pk FROM languoid AS l, (%s) AS f
+WHERE l.pk = f.pk AND l.family_pk IS DISTINCT FROM f.family_pk
+ORDER BY l.pk""" % FAMILIES).fetchall()
+
+
+def update_family(db=None):
+    """Set the top-level family of all languoids according to the closure table with a
+    single UPDATE statement.
+
+    :return: number of updated languoids.
+    """
+    return (db or DBSession).execute("""\
+UPDATE languoid SET family_pk = f.family_pk FROM (%s) AS f
+WHERE languoid.pk = f.pk AND languoid.family_pk IS DISTINCT FROM f.family_pk"""
+        % FAMILIES).rowcount
+
+
+def update_languoids(rows, db=None):
+    """Bulk update of languoid columns in batches.
+
+    :param rows: list of dicts mapping column names to new values, and 'pk_' to the pk of\
+    the languoid; all dicts must have the same keys.
+    """
+    if not rows:
+        return
+    db = db or DBSession
+    table = Languoid.__table__
+    sql = table.update()\
+        .where(table.c.pk == bindparam('pk_'))\
+        .values(**dict(
+            (col, bindparam(col, type_=table.c[col].type))
+            for col in rows[0] if col != 'pk_'))
+    for i in range(0, len(rows), BATCH_SIZE):
+        db.execute(sql, rows[i:i + BATCH_SIZE])
+
+
+def update_intervals(index=None, db=None):
+    """Recompute the nested intervals [lft, rgt] of preorder numbers of all languoids.
+
+    Only rows whose interval changed are written.
+
+    :return: number of updated languoids.
+    """
+    db = db or DBSession
+    start = time.time()
+    index = index or TreeIndex.from_db(db)
+    current = dict(
+        (row[0], tuple(row[1:])) for row in
+        db.execute('select pk, lft, rgt from languoid'))
+    rows = []
+    for pk, (lft, rgt) in index.intervals():
+        if current.get(pk) != (lft, rgt):
+            rows.append(dict(pk_=pk, lft=lft, rgt=rgt))
+    update_languoids(rows, db=db)
+    log.info('nested intervals: %s languoids updated in %.2fs', len(rows), time.time() - start)
+    return len(rows)
+
+
+def update_ancestry(index=None, db=None):
+    """Recompute the materialized line of ancestors of all languoids.
+
+    Only rows whose ancestry changed are written.
+
+    :return: number of updated languoids.
+    """
+    db = db or DBSession
+    start = time.time()
+    index = index or TreeIndex.from_db(db)
+    flags = set(tuple(row) for row in db.execute("""\
+SELECT vs.language_pk, p.id FROM valueset as vs, parameter as p
+WHERE vs.parameter_pk = p.pk AND p.id in ('fc', 'sc') AND vs.description != ''"""))
+
+    def ancestor(pk):
+        i = index.index[pk]
+        return [
+            pk, index.id[i], index.name[i], index.level[i],
+            (pk, 'fc') in flags, (pk, 'sc') in flags]
+
+    rows = []
+    for pk, ancestry in db.execute('select pk, ancestry from languoid'):
+        if pk not in index:
+            continue
+        new = [ancestor(a) for a in reversed(index.ancestors(pk))]
+        if ancestry is None or json.loads(ancestry) != new:
+            rows.append(dict(pk_=pk, ancestry=new))
+    update_languoids(rows, db=db)
+    log.info('ancestry: %s languoids updated in %.2fs', len(rows), time.time() - start)
+    return len(rows)
+
+
+def update_screfs(index=None, db=None):
+    """Recompute the effective subclassification justification of all languoids, i.e.
+    the sc valueset with references of the languoid itself or its closest ancestor.
+
+    Only rows whose justification changed are written.
+
+    :return: number of updated languoids.
+    """
+    db = db or DBSession
+    start = time.time()
+    index = index or TreeIndex.from_db(db)
+    own = dict(db.execute("""\
+SELECT vs.language_pk, vs.pk FROM valueset as vs, parameter as p
+WHERE vs.parameter_pk = p.pk AND p.id = 'sc'
+AND EXISTS (SELECT 1 FROM valuesetreference as r WHERE r.valueset_pk = vs.pk)"""
+    ).fetchall())
+
+    # in preorder, fathers are visited before their children:
+    effective = []
+    for i, pk in enumerate(index.pk):
+        father = index.father[i]
+        effective.append(own.get(pk, effective[father] if father >= 0 else None))
+
+    current = dict(db.execute('select pk, sc_valueset_pk from languoid').fetchall())
+    rows = [
+        dict(pk_=pk, sc_valueset_pk=vs_pk) for pk, vs_pk in zip(index.pk, effective)
+        if current.get(pk) != vs_pk]
+    update_languoids(rows, db=db)
+    log.info(
+        'subclassification justifications: %s languoids updated in %.2fs',
+        len(rows), time.time() - start)
+    return len(rows)
+
+
+def update_geocoords(index=None, db=None):
+    """Recompute the coordinates of descendants of all languoids, grouped by the child
+    of the languoid, i.e. the branch, they belong to - see Languoid.get_geocoords.
+
+    Only rows whose coordinates changed are written.
+
+    :return: number of updated languoids.
+    """
+    db = db or DBSession
+    start = time.time()
+    index = index or TreeIndex.from_db(db)
+    coords = dict((row[0], row) for row in db.execute("""\
+SELECT l.pk, l.name, l.longitude, l.latitude, l.id
+FROM language as l, languoid as ll WHERE l.pk = ll.pk AND l.latitude IS NOT NULL"""))
+
+    geocoords = {}
+    # we go through the languoids in preorder, thus coordinates are ordered by branch:
+    for pk in index.pk:
+        if pk in coords:
+            lineage = [pk] + index.ancestors(pk)
+            for branch, parent in zip(lineage, lineage[1:]):
+                geocoords.setdefault(parent, []).append([branch] + list(coords[pk][1:]))
+
+    rows = []
+    for pk, current in db.execute('select pk, geocoords from languoid'):
+        new = geocoords.get(pk, [])
+        if current is None or json.loads(current) != new:
+            rows.append(dict(pk_=pk, geocoords=new))
+    update_languoids(rows, db=db)
+    log.info('geocoords: %s languoids updated in %.2fs', len(rows), time.time() - start)
+    return len(rows)
+
+
+class TreeIndex(object):
+    """Compact index of the languoid tree.
+
+    Languoids are numbered in preorder, i.e. by their entry number in an Euler tour of
+    the tree, with siblings ordered like Languoid.children. Node data is stored in
+    parallel arrays indexed by this number. The descendants of node i are the nodes
+    i + 1, ..., exit[i] - 1, thus subtree membership, depth and top-level family can be
+    looked up in constant time, the line of ancestors in O(depth).
+    """
+    def __init__(self, rows):
+        """
+        :param rows: iterable of (pk, father_pk, level, status, name, id) tuples.
+        """
+        nodes = {}
+        children = {None: []}
+        for row in rows:
+            nodes[row[0]] = row
+            children.setdefault(row[1], []).append(row[0])
+            children.setdefault(row[0], [])
+        for pks in children.values():
+            pks.sort(key=lambda pk: (nodes[pk][4], nodes[pk][5]))
+
+        self.index = {}
+        self.pk = array('l')
+        self.father = array('l')
+        self.depth = array('l')
+        self.exit = array('l')
+        self.top = array('l')
+        self.level = []
+        self.status = []
+        self.name = []
+        self.id = []
+
+        # iterative depth-first traversal; (None, i) marks the exit from node i.
+        stack = [(pk, -1) for pk in reversed(children[None])]
+        while stack:
+            pk, father = stack.pop()
+            if pk is None:
+                self.exit[father] = len(self.pk)
+                continue
+            i = len(self.pk)
+            self.index[pk] = i
+            row = nodes[pk]
+            self.pk.append(pk)
+            self.father.append(father)
+            self.depth.append(self.depth[father] + 1 if father >= 0 else 0)
+            self.exit.append(0)
+            self.top.append(self.top[father] if father >= 0 else i)
+            self.level.append(getattr(row[2], 'value', row[2]))
+            self.status.append(getattr(row[3], 'value', row[3]))
+            self.name.append(row[4])
+            self.id.append(row[5])
+            stack.append((None, i))
+            stack.extend((child, i) for child in reversed(children[pk]))
+        if len(self.pk) != len(nodes):
+            raise ValueError('languoid tree is not a forest')
+
+    @classmethod
+    def from_db(cls, db=None):
+        return cls((db or DBSession).execute("""\
+SELECT l.pk, ll.father_pk, ll.level, ll.status, l.name, l.id
+FROM language as l, languoid as ll WHERE l.pk = ll.pk"""))
+
+    def __len__(self):
+        return len(self.pk)
+
+    def __contains__(self, pk):
+        return pk in self.index
+
+    def father_pk(self, pk):
+        father = self.father[self.index[pk]]
+        return self.pk[father] if father >= 0 else None
+
+    def ancestors(self, pk):
+        """
+        :return: list of pks of the ancestors of pk, starting with the father.
+        """
+        res = []
+        i = self.father[self.index[pk]]
+        while i >= 0:
+            res.append(self.pk[i])
+            i = self.father[i]
+        return res
+
+    def children(self, pk):
+        i = self.index[pk]
+        j = i + 1
+        res = []
+        while j < self.exit[i]:
+            res.append(self.pk[j])
+            j = self.exit[j]
+        return res
+
+    def descendants(self, pk):
+        i = self.index[pk]
+        return self.pk[i + 1:self.exit[i]].tolist()
+
+    def is_descendant(self, pk, ancestor_pk):
+        i, j = self.index[pk], self.index[ancestor_pk]
+        return j < i < self.exit[j]
+
+    def intervals(self):
+        """
+        :return: generator of (pk, (lft, rgt)) pairs, where lft is the preorder number of\
+        the languoid and rgt the highest preorder number within its subtree.
+        """
+        for i, pk in enumerate(self.pk):
+            yield pk, (i + 1, self.exit[i])
+
+    def get_depth(self, pk):
+        return self.depth[self.index[pk]]
+
+    def top_level(self, pk):
+        """
+        :return: pk of the top-level family of pk, or None for top-level languoids.
+        """
+        i = self.index[pk]
+        return self.pk[self.top[i]] if self.top[i] != i else None
+
+
+tree_index = VersionedCache(TreeIndex.from_db)
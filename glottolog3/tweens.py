@@ -0,0 +1,75 @@
+"""
+Conditional GET support for languoid and reference resources.
+
+The validators of a resource are derived from the update timestamp of the resource and
+the data version, so requests with matching If-None-Match or If-Modified-Since headers
+are answered with 304 before the resource is rendered.
+"""
+from hashlib import md5
+
+from pyramid.interfaces import IRoutesMapper
+from pyramid.response import Response
+from clld.db.meta import DBSession
+
+from glottolog3.cache import data_version
+
+# route names mapped to the tables of the resources:
+ROUTES = {
+    'language': 'language',
+    'language_alt': 'language',
+    'source': 'source',
+    'source_alt': 'source',
+}
+
+
+def get_validators(request, route, match):
+    """
+    :return: pair (etag, last_modified) or None if the resource does not exist.
+    """
+    updated = DBSession.execute(
+        'select updated from %s where id = :id' % ROUTES[route], dict(id=match['id'])
+    ).fetchone()
+    if not updated:
+        return
+    version = data_version.get()
+    etag = md5(('%s|%s|%s|%s|%s|%s' % (
+        route, match['id'], match.get('ext', ''), request.accept,
+        updated[0], version)).encode('utf8')).hexdigest()
+    last_modified = max(filter(None, [updated[0], version]) or [None])
+    if last_modified:
+        last_modified = last_modified.replace(microsecond=0)
+    return etag, last_modified
+
+
+def conditional_get_tween_factory(handler, registry):
+    mapper = registry.queryUtility(IRoutesMapper)
+
+    def conditional_get_tween(request):
+        if request.method not in ['GET', 'HEAD'] or not mapper:
+            return handler(request)
+        info = mapper(request)
+        route = info['route'].name if info['route'] else None
+        if route not in ROUTES:
+            return handler(request)
+
+        validators = get_validators(request, route, info['match'])
+        if not validators:
+            return handler(request)
+        etag, last_modified = validators
+
+        if (request.if_none_match and etag in request.if_none_match) or (
+                not request.if_none_match
+                and last_modified
+                and request.if_modified_since
+                and request.if_modified_since >= last_modified):
+            response = Response(status=304)
+        else:
+            response = handler(request)
+            if response.status_int != 200:
+                return response
+        response.etag = etag
+        response.last_modified = last_modified
+        response.vary = ('Accept',)
+        return response
+
+    return conditional_get_tween
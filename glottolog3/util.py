@@ -1,18 +1,20 @@
 from json import dumps
 import re
+import zlib
 from itertools import cycle
 
 import colander
 from sqlalchemy import or_, not_
-from sqlalchemy.orm import joinedload, joinedload_all
+from sqlalchemy.orm import joinedload, joinedload_all, Session
 from sqlalchemy.sql.expression import func
 from pyramid.httpexceptions import HTTPFound
+from pyramid.threadlocal import get_current_registry
+from pyramid.settings import asbool
 
 from clld.db.meta import DBSession
 from clld.db.models.common import (
     Identifier, LanguageIdentifier, IdentifierType, Language, Source, LanguageSource,
 )
-from clld.db.util import icontains
 from clld.web.util.helpers import link, icon
 from clld.web.util.htmllib import HTML
 from clld.web.icon import SHAPES
@@ -24,6 +26,10 @@ from glottolog3.models import (
     LanguoidStatus,
 )
 from glottolog3.maps import LanguoidsMap
+from glottolog3.cache import VersionedCache, fragment_cache
+from glottolog3 import fts
+from glottolog3.stats import provider_statistics
+from glottolog3.vocabulary import Term, get_vocabulary, MODELS as VOCABULARY_MODELS
 
 
 REF_PATTERN = re.compile('\*\*(?P<id>[0-9]+)\*\*')
@@ -48,7 +54,7 @@ class ModelInstance(object):
     def serialize(self, node, appstruct):
         if appstruct is colander.null:
             return colander.null
-        if not isinstance(appstruct, self.cls):
+        if not isinstance(appstruct, (self.cls, Term)):
             raise colander.Invalid(node, '%r is not a boolean' % appstruct)
         return getattr(appstruct, self.attr)
 
@@ -97,7 +103,9 @@ def get_params(params, **kw):
     schema = colander.SchemaNode(colander.Mapping())
     for name, cls in dict(languoid=Languoid, doctype=Doctype, macroarea=Macroarea).items():
         plural = name + 's'
-        _kw = dict(collection=kw.get(plural))
+        # macroareas and doctypes are looked up in the vocabulary cache by default:
+        _kw = dict(collection=kw.get(plural) or (
+            get_vocabulary(cls) if cls in VOCABULARY_MODELS else None))
         if name == 'languoid':
             _kw['alias'] = 'hid'
         schema.add(
@@ -121,44 +129,153 @@ def get_params(params, **kw):
         return default_params(), {}
 
 
-def getRefs(params):
-    query = DBSession.query(Ref)
-    filtered = False
+def use_intervals():
+    """
+    :return: flag signaling whether descendants are looked up via the nested intervals\
+    of languoids rather than the closure table - see setting glottolog3.nested_intervals.
+    """
+    settings = get_current_registry().settings or {}
+    return asbool(settings.get('glottolog3.nested_intervals', False))
 
-    for param, value in params['biblio'].items():
-        if value:
-            filtered = True
-            query = query.filter(icontains(getattr(Ref, param), value))
 
-    if params.get('languoids'):
-        filtered = True
-        lids = DBSession.query(TreeClosureTable.child_pk)\
-            .filter(TreeClosureTable.parent_pk.in_([l.pk for l in params['languoids']]))\
+def descendants(languoids, intervals=None):
+    """
+    :param languoids: list of Languoid instances.
+    :param intervals: flag to select the lookup via nested intervals or closure table;\
+    defaults to the result of use_intervals.
+    :return: subquery selecting the pks of languoids and all their descendants.
+    """
+    if intervals is None:
+        intervals = use_intervals()
+    if intervals:
+        return DBSession.query(Languoid.pk)\
+            .filter(or_(*[Languoid.lft.between(l.lft, l.rgt) for l in languoids]))\
             .subquery()
-        query = query.join(LanguageSource, LanguageSource.source_pk == Ref.pk)\
-            .filter(LanguageSource.language_pk.in_(lids))
+    return DBSession.query(TreeClosureTable.child_pk)\
+        .filter(TreeClosureTable.parent_pk.in_([l.pk for l in languoids]))\
+        .subquery()
 
-    if params.get('doctypes'):
-        filtered = True
-        query = query.join(Refdoctype)\
-            .filter(Refdoctype.doctype_pk.in_([l.pk for l in params['doctypes']]))
 
-    if params.get('macroareas'):
-        filtered = True
-        query = query.join(Refmacroarea)\
-            .filter(Refmacroarea.macroarea_pk.in_([l.pk for l in params['macroareas']]))
+def getRefs(params):
+    """
+    :return: query selecting the pks of the refs matching params, or an empty list if\
+    no filter is given.
+
+    Filters on associations are expressed as semi-joins on the pk of Ref - thus no
+    DISTINCT is needed - and the order of evaluation is left to the query planner.
+    Callers hydrate refs via Ref.pk.in_(...).
+    """
+    filters = []
 
-    if not filtered:
+    if params.get('languoids'):
+        filters.append(Ref.pk.in_(DBSession.query(LanguageSource.source_pk).filter(
+            LanguageSource.language_pk.in_(descendants(params['languoids'])))))
+
+    for name, model, col in [
+        ('doctype', Refdoctype, Refdoctype.doctype_pk),
+        ('macroarea', Refmacroarea, Refmacroarea.macroarea_pk),
+    ]:
+        if params.get(name + 's'):
+            filters.append(Ref.pk.in_(DBSession.query(model.ref_pk).filter(
+                col.in_([obj.pk for obj in params[name + 's']]))))
+
+    for param, value in sorted(params['biblio'].items()):
+        if value:
+            filters.extend(fts.matches(param, value))
+
+    if not filters:
         return []
 
-    return query.distinct()
+    # biblio fields are columns of the source table, thus we select from the join:
+    query = DBSession.query(Ref.pk).select_from(Ref)
+    for criterion in filters:
+        query = query.filter(criterion)
+    return query
+
+
+def stream_bibtex(refs, batch_size=500):
+    """
+    :param refs: query as returned by getRefs.
+    :return: generator of the UTF-8 encoded BibTeX records of refs.
+
+    The records are streamed in batches from a server-side cursor over the pks of refs;
+    since the generator is consumed after the request's transaction has ended, it uses
+    a session of its own.
+    """
+    conn = DBSession.get_bind().connect()
+    session = Session(bind=conn)
+    try:
+        pks = refs.with_session(session).order_by(Ref.pk)\
+            .execution_options(stream_results=True)
+        batch = []
+        for pk, in pks.yield_per(batch_size):
+            batch.append(pk)
+            if len(batch) == batch_size:
+                for chunk in _bibtex_batch(session, batch):
+                    yield chunk
+                batch = []
+        for chunk in _bibtex_batch(session, batch):
+            yield chunk
+    finally:
+        session.close()
+        conn.close()
+
+
+def _bibtex_batch(session, pks):
+    if pks:
+        for ref in session.query(Ref).filter(Ref.pk.in_(pks))\
+                .options(joinedload(Ref.data)).order_by(Ref.pk):
+            yield (u'%s\n\n' % ref.bibtex()).encode('utf8')
+        # keep the identity map - and thus memory consumption - small:
+        session.expunge_all()
+
+
+def gzipped(chunks):
+    """
+    :return: generator of the gzip compressed content of chunks.
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        chunks.close()
+
+
+def get_iso_map():
+    """
+    :return: dict mapping ISO 639-3 codes to glottocodes.
+    """
+    res = {}
+    for iso, glottocode in DBSession.query(Identifier.name, Language.id)\
+            .join(LanguageIdentifier, LanguageIdentifier.identifier_pk == Identifier.pk)\
+            .join(Language, Language.pk == LanguageIdentifier.language_pk)\
+            .filter(Identifier.type == IdentifierType.iso.value)\
+            .order_by(Language.pk):
+        res.setdefault(iso, glottocode)
+    return res
+
+
+iso_map = VersionedCache(get_iso_map)
+
+
+def resolve_iso(codes):
+    """
+    :return: dict mapping each of the ISO 639-3 codes to a glottocode or None.
+    """
+    isos = iso_map.get()
+    return dict((code, isos.get(code)) for code in codes)
 
 
 def provider_index_html(request=None, **kw):
+    stats = provider_statistics.get()
     return {
         'providers': DBSession.query(Provider),
-        'totalrefs': DBSession.query(Source).count(),
-        'totalnodes': DBSession.query(Language).count(),
+        'totalrefs': stats['totalrefs'],
+        'totalnodes': stats['totalnodes'],
     }
 
 
@@ -236,7 +353,7 @@ def language_index_html(request=None, **kw):
     res = dict(
         countries=dumps([
             '%s (%s)' % (c.name, c.id) for c in
-            DBSession.query(Country).order_by(Country.description)]),
+            sorted(get_vocabulary(Country), key=lambda c: c.description)]),
         params={
             'name': '',
             'iso': '',
@@ -282,6 +399,25 @@ def get_icon_map(request, context):
     return icon_map
 
 
+def load_tree_classifications(context):
+    # the classification tree marks languoids with classification comments, so we load
+    # these for all languoids shown in one go:
+    languoids = [context] + context.children
+    if context.father:
+        languoids.extend(context.father.children)
+    Languoid.load_classifications(languoids)
+
+
+def fragment(req, ctx, section, render):
+    """
+    :return: HTML fragment section of the detail page of ctx, rendered by calling render\
+    if not cached.
+    """
+    # rendered fragments contain absolute URLs and may depend on request parameters:
+    return fragment_cache.get(
+        (ctx.pk, section, req.application_url, req.query_string), render)
+
+
 def language_detail_html(request=None, context=None, **kw):
     return dict(icon_map=get_icon_map(request, context))
 
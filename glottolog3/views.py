@@ -7,24 +7,26 @@ from pyramid.response import Response
 from pyramid.httpexceptions import (
     HTTPNotAcceptable, HTTPNotFound, HTTPFound, HTTPMovedPermanently,
 )
-from sqlalchemy import or_, desc
-from sqlalchemy.sql.expression import func
 from clld.db.meta import DBSession
-from clld.db.models.common import (
-    Language, Source, LanguageSource, LanguageIdentifier, Identifier, IdentifierType,
-)
-from clld.db.util import icontains
+from clld.db.models.common import Language, Source, LanguageSource
 from clld.web.util.helpers import JS, get_adapter
 from clld.web.util.multiselect import MultiSelect
 from clld.lib import bibtex
 from clld.interfaces import IRepresentation
 
 from glottolog3.models import (
-    Languoid, LanguoidStatus, LanguoidLevel, Macroarea, Doctype, Refprovider, Provider,
-    TreeClosureTable, Ref, Refmacroarea, Refdoctype,
+    Languoid, Macroarea, Doctype, Refprovider, Provider,
+    Ref, Refmacroarea, Refdoctype,
 )
 from glottolog3.config import CFG
-from glottolog3.util import getRefs, get_params
+from glottolog3.util import (
+    getRefs, get_params, resolve_iso, stream_bibtex, gzipped,
+)
+from glottolog3.stats import get_statistics, compute_glottolog_statistics
+from glottolog3.tree import tree_index
+from glottolog3.cache import VersionedCache, fragment_cache, count_cache
+from glottolog3.autocomplete import autocomplete_index
+from glottolog3.vocabulary import get_vocabulary
 from glottolog3.datatables import Refs
 
 
@@ -33,7 +35,7 @@ YEAR_PATTERN = re.compile('[0-9]{4}$')
 
 class LanguoidsMultiSelect(MultiSelect):
     def format_result(self, l):
-        return dict(id=l.id, text=l.name, level=l.level.value)
+        return dict(id=l.id, text=l.name, level=getattr(l.level, 'value', l.level))
 
     def get_options(self):
         opts = super(LanguoidsMultiSelect, self).get_options()
@@ -43,84 +45,79 @@ class LanguoidsMultiSelect(MultiSelect):
 
 
 def iso(request):
-    q = DBSession.query(Languoid).join(LanguageIdentifier).join(Identifier)\
-        .filter(Identifier.type == IdentifierType.iso.value)\
-        .filter(Identifier.name == request.matchdict['id']).first()
-    if not q:
+    glottocode = resolve_iso([request.matchdict['id']])[request.matchdict['id']]
+    if not glottocode:
         return HTTPNotFound()
-    params = {}
     if 'ext' in request.matchdict:
-        params['ext'] = request.matchdict['ext']
-    return HTTPFound(location=request.resource_url(q, **params))
+        return HTTPFound(location=request.route_url(
+            'language_alt', id=glottocode, ext=request.matchdict['ext']))
+    return HTTPFound(location=request.route_url('language', id=glottocode))
+
+
+def isos(request):
+    """batch lookup of glottocodes for a comma separated list of ISO 639-3 codes.
+    """
+    return resolve_iso(filter(None, request.params.get('codes', '').split(',')))
 
 
 def glottologmeta(request):
-    q = DBSession.query(Languoid)\
-        .filter(Language.active == True)\
-        .filter(or_(Languoid.status == LanguoidStatus.established,
-                    Languoid.status == LanguoidStatus.unattested))
-    qt = q.filter(Languoid.father_pk == None)
-    res = {
-        'last_update': DBSession.query(Language.updated)\
-        .order_by(desc(Language.updated)).first()[0],
-        'number_of_families': qt.filter(Languoid.level == LanguoidLevel.family).count(),
-        'number_of_isolates': qt.filter(Languoid.level == LanguoidLevel.language).count(),
-    }
-    ql = q.filter(Languoid.hid != None)
-    res['number_of_languages'] = {
-        'all': ql.count(),
-        'pidgin': qt.filter(Language.name == 'Pidgin').one().child_language_count,
-        'artificial': qt.filter(Language.name == 'Artificial Language').one().child_language_count,
-        'sign': sum(l.child_language_count for l in qt.filter(Language.name.contains('Sign '))),
-    }
-    res['number_of_languages']['l1'] = res['number_of_languages']['all'] \
-        - res['number_of_languages']['pidgin']\
-        - res['number_of_languages']['artificial']\
-        - res['number_of_languages']['sign']
-    return res
+    return get_statistics('glottolog') or compute_glottolog_statistics()
+
+
+def get_childnodes_fragments():
+    """
+    :return: dict mapping languoid pks - and None for the top-level - to the list of \
+    nodes to display for the active children in the tree widget.
+    """
+    index = tree_index.get()
+    active = set(r[0] for r in DBSession.execute(
+        'select pk from language where active = true'))
+    fragments = {None: []}
+    # in preorder, siblings appear ordered by name:
+    for i, pk in enumerate(index.pk):
+        if pk not in active:
+            continue
+        name, subtree = index.name[i], index.exit[i] - i
+        fragments.setdefault(index.father_pk(pk), []).append({
+            'label': ('%s (%s)' % (name, subtree - 1)) if subtree > 1 else name,
+            'glottocode': index.id[i],
+            'lname': name,
+            'id': pk,
+            'level': index.level[i],
+            'load_on_demand': subtree > 1})
+    return fragments
+
+
+childnodes_fragments = VersionedCache(get_childnodes_fragments)
 
 
 def childnodes(request):
     if request.params.get('t') == 'select2':
-        query = DBSession.query(Languoid.id, Languoid.name, Languoid.level)\
-            .filter(icontains(Languoid.name, request.params.get('q')))
-        total = query.count()
+        matches, total = autocomplete_index.get().search(request.params.get('q', ''))
         ms = LanguoidsMultiSelect(request, Languoid, 'x', url='x')
         return dict(
-            results=[ms.format_result(l) for l in query.limit(100)],
+            results=[ms.format_result(l) for l in matches],
             context={},
-            more=total > 500)
+            more=total > len(matches))
 
-    query = DBSession.query(
-        Languoid.pk,
-        Languoid.id,
-        Languoid.name,
-        Languoid.level,
-        func.count(TreeClosureTable.child_pk).label('children'))\
-        .filter(Language.pk == TreeClosureTable.parent_pk)\
-        .filter(Language.active == True)
+    fragments = childnodes_fragments.get()
+    request.response.etag = '%s' % childnodes_fragments.version
+    request.response.conditional_response = True
 
     if request.params.get('node'):
-        query = query.filter(Languoid.father_pk == int(request.params['node']))
-    else:
-        # narrow down selection of top-level nodes in the tree:
-        query = query.filter(Languoid.father_pk == None)
-        if request.params.get('q'):
-            query = query.filter(Language.name.contains(request.params.get('q')))
-
-    query = query.group_by(Languoid.pk,
-        Languoid.id,
-        Languoid.name,
-        Languoid.level).order_by(Language.name)
-    return [{
-        'label': ('%s (%s)' % (l.name, l.children - 1))
-            if l.children > 1 else l.name,
-        'glottocode': l.id,
-        'lname': l.name,
-        'id': l.pk,
-        'level': l.level.value,
-        #'children': l.children
-        'load_on_demand': l.children > 1} for l in query]
+        return fragments.get(int(request.params['node']), [])
+
+    # narrow down selection of top-level nodes in the tree:
+    nodes = fragments[None]
+    if request.params.get('q'):
+        nodes = [n for n in nodes if request.params['q'] in n['lname']]
+    return nodes
+
+
+def cachestats(request):
+    """hit and miss counts and sizes of the caches of the worker serving the request.
+    """
+    return {'fragments': fragment_cache.stats(), 'counts': count_cache.stats()}
 
 
 def credits(request):
@@ -129,8 +126,8 @@ def credits(request):
 
 def glossary(request):
     return {
-        'macroareas': DBSession.query(Macroarea).order_by(Macroarea.id),
-        'doctypes': DBSession.query(Doctype).order_by(Doctype.name)}
+        'macroareas': get_vocabulary(Macroarea),
+        'doctypes': sorted(get_vocabulary(Doctype), key=lambda d: d.name)}
 
 
 def cite(request):
@@ -160,8 +157,8 @@ def languages(request):
 def langdoccomplexquery(request):
     res = {
         'dt': None,
-        'doctypes': DBSession.query(Doctype).order_by(Doctype.id),
-        'macroareas': DBSession.query(Macroarea).order_by(Macroarea.id),
+        'doctypes': get_vocabulary(Doctype),
+        'macroareas': get_vocabulary(Macroarea),
         'ms': {}
     }
 
@@ -179,8 +176,13 @@ def langdoccomplexquery(request):
         res['dt'] = Refs(request, Source, cq=1, **reqparams)
 
     fmt = request.params.get('format')
+    if fmt == 'bib':
+        return bibtex_response(request, res['refs'])
     if fmt:
-        db = bibtex.Database([ref.bibtex() for ref in res['refs']])
+        db = bibtex.Database([
+            ref.bibtex() for ref in
+            DBSession.query(Ref).filter(Ref.pk.in_(res['refs'].subquery()))]
+            if res['refs'] else [])
         for name, adapter in request.registry.getAdapters([db], IRepresentation):
             if name == fmt:
                 return adapter.render_to_response(db, request)
@@ -189,6 +191,24 @@ def langdoccomplexquery(request):
     return res
 
 
+def bibtex_response(request, refs):
+    """BibTeX export streamed - and gzip compressed if acceptable to the client - to
+    keep memory consumption flat for large result sets.
+    """
+    response = Response(content_type='text/x-bibtex', charset='utf-8')
+    response.content_disposition = 'attachment; filename="glottolog-refs.bib"'
+    response.vary = ('Accept-Encoding',)
+    if refs:
+        app_iter = stream_bibtex(refs)
+        # clients which do not send Accept-Encoding get the uncompressed export:
+        if 'Accept-Encoding' in request.headers \
+                and request.accept_encoding.best_match(['gzip', 'identity']) == 'gzip':
+            app_iter = gzipped(app_iter)
+            response.content_encoding = 'gzip'
+        response.app_iter = app_iter
+    return response
+
+
 def redirect_languoid_xhtml(req):
     return HTTPMovedPermanently(location=req.route_url('language', id=req.matchdict['id']))
 
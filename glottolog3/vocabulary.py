@@ -0,0 +1,63 @@
+"""
+Per-worker cache of the controlled vocabularies - macroareas, doctypes, countries,
+providers and the languoid status values in use - loaded once per data version.
+
+Terms are stored as plain objects rather than ORM instances, so they can be shared
+across requests and sessions.
+"""
+from clld.db.meta import DBSession
+from clld.db.util import get_distinct_values
+from clld.util import UnicodeMixin
+
+from glottolog3.models import Macroarea, Doctype, Country, Provider, Languoid
+from glottolog3.cache import VersionedCache
+
+
+class Term(UnicodeMixin):
+    """Copy of a vocabulary item, labeled like the ORM instance it was read from - so it
+    can be passed where instances are rendered, e.g. as MultiSelect collection.
+    """
+    __slots__ = ('pk', 'id', 'name', 'description', 'label')
+
+    def __init__(self, pk, id, name, description, label=None):
+        self.pk = pk
+        self.id = id
+        self.name = name
+        self.description = description
+        self.label = name if label is None else label
+
+    def __unicode__(self):
+        return self.label or ''
+
+
+# models with a vocabulary mapped to the name of the vocabulary:
+MODELS = {
+    Macroarea: 'macroareas',
+    Doctype: 'doctypes',
+    Country: 'countries',
+    Provider: 'providers',
+}
+
+
+def get_vocabularies():
+    """
+    :return: dict mapping names of vocabularies to lists of Term, ordered by id, and\
+    'statuses' to the list of languoid status values in use.
+    """
+    res = dict(
+        (name, [
+            Term(obj.pk, obj.id, obj.name, obj.description, '%s' % obj)
+            for obj in DBSession.query(model).order_by(model.id)])
+        for model, name in MODELS.items())
+    res['statuses'] = get_distinct_values(Languoid.status)
+    return res
+
+
+vocabularies = VersionedCache(get_vocabularies)
+
+
+def get_vocabulary(name_or_model):
+    """
+    :return: list of Term of the vocabulary with the given name or model class.
+    """
+    return vocabularies.get()[MODELS.get(name_or_model, name_or_model)]
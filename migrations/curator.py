@@ -0,0 +1,332 @@
+# Helpers of the curator migrations, refreshing the data derived from the languoid tree.
+#
+# fab alembic_revision copies this code into each migration it generates, so a migration
+# keeps running the helpers as they were when it was created - changes here only affect
+# migrations generated later. Thus, the helpers must only run SQL on the connection of
+# the migration and never import application code.
+import json
+from collections import defaultdict
+
+import sqlalchemy as sa
+
+BATCH_SIZE = 10000
+
+
+def check_tree(conn):
+    """Make sure the languoid tree has no cycles - the recursive closure query would not
+    terminate otherwise.
+    """
+    fathers = dict(conn.execute('SELECT pk, father_pk FROM languoid').fetchall())
+    done = set()
+    for pk in fathers:
+        chain = []
+        while pk is not None and pk not in done:
+            if pk in chain:
+                raise ValueError('cycle in languoid tree at %s' % pk)
+            chain.append(pk)
+            pk = fathers[pk]
+        done.update(chain)
+
+
+def update_closure(conn):
+    """Rewrite the closure rows of the subtrees below languoids which have been added or
+    attached to a different father, and the descendant counts of their former and new
+    ancestors.
+    """
+    # the father of a languoid according to the closure table is the parent at depth 1:
+    conn.execute("""\
+CREATE TEMPORARY TABLE curator_moved AS
+SELECT l.pk FROM languoid AS l
+LEFT OUTER JOIN treeclosuretable AS t ON t.child_pk = l.pk AND t.depth = 1
+WHERE l.father_pk IS DISTINCT FROM t.parent_pk
+OR NOT EXISTS (
+    SELECT 1 FROM treeclosuretable AS r WHERE r.child_pk = l.pk AND r.depth = 0)""")
+    conn.execute("""\
+CREATE TEMPORARY TABLE curator_subtree AS
+SELECT pk FROM curator_moved
+UNION
+SELECT t.child_pk FROM treeclosuretable AS t JOIN curator_moved AS m ON t.parent_pk = m.pk""")
+    ancestors = """\
+SELECT t.parent_pk FROM treeclosuretable AS t JOIN curator_moved AS m ON t.child_pk = m.pk"""
+    conn.execute('CREATE TEMPORARY TABLE curator_ancestors AS ' + ancestors)
+
+    conn.execute(
+        'DELETE FROM treeclosuretable WHERE child_pk IN (SELECT pk FROM curator_subtree)')
+    conn.execute("""\
+INSERT INTO treeclosuretable (active, created, updated, child_pk, parent_pk, depth)
+WITH RECURSIVE closure (child_pk, parent_pk, depth) AS (
+    SELECT pk, pk, 0 FROM languoid WHERE pk IN (SELECT pk FROM curator_subtree)
+    UNION ALL
+    SELECT c.child_pk, l.father_pk, c.depth + 1
+    FROM closure AS c JOIN languoid AS l ON c.parent_pk = l.pk
+    WHERE l.father_pk IS NOT NULL
+)
+SELECT true, now(), now(), child_pk, parent_pk, depth FROM closure""")
+    conn.execute('INSERT INTO curator_ancestors ' + ancestors)
+
+    conn.execute("""\
+UPDATE languoid SET
+    child_family_count = c.families,
+    child_language_count = c.languages,
+    child_dialect_count = c.dialects
+FROM (
+    SELECT
+        p.pk AS pk,
+        count(CASE WHEN l.level = 'family' THEN 1 END) AS families,
+        count(CASE WHEN l.level = 'language' THEN 1 END) AS languages,
+        count(CASE WHEN l.level = 'dialect' THEN 1 END) AS dialects
+    FROM languoid AS p LEFT OUTER JOIN (
+        treeclosuretable AS t JOIN languoid AS l ON t.child_pk = l.pk AND t.depth > 0
+    ) ON t.parent_pk = p.pk
+    WHERE p.pk IN (SELECT parent_pk FROM curator_ancestors)
+    GROUP BY p.pk
+) AS c
+WHERE languoid.pk = c.pk""")
+    conn.execute("""\
+DELETE FROM descendantcount
+WHERE languoid_pk IN (SELECT parent_pk FROM curator_ancestors)""")
+    for macroarea, join, group in [
+        ('NULL', '', ''),
+        (
+            'm.macroarea_pk',
+            'JOIN languoidmacroarea AS m ON m.languoid_pk = l.pk',
+            ', m.macroarea_pk'),
+    ]:
+        conn.execute("""\
+INSERT INTO descendantcount
+    (active, created, updated, languoid_pk, macroarea_pk, level, status, count)
+SELECT true, now(), now(), t.parent_pk, %(macroarea)s, l.level, l.status, count(*)
+FROM treeclosuretable AS t JOIN languoid AS l ON t.child_pk = l.pk %(join)s
+WHERE t.depth > 0 AND t.parent_pk IN (SELECT parent_pk FROM curator_ancestors)
+GROUP BY t.parent_pk, l.level, l.status%(group)s""" % locals())
+
+    for table in ['curator_moved', 'curator_subtree', 'curator_ancestors']:
+        conn.execute('DROP TABLE %s' % table)
+
+
+def update_family(conn):
+    conn.execute("""\
+UPDATE languoid SET family_pk = f.family_pk
+FROM (
+    SELECT l.pk AS pk, t.parent_pk AS family_pk
+    FROM languoid AS l LEFT OUTER JOIN (
+        treeclosuretable AS t JOIN languoid AS f
+        ON t.parent_pk = f.pk AND f.father_pk IS NULL AND t.depth > 0
+    ) ON t.child_pk = l.pk
+) AS f
+WHERE languoid.pk = f.pk AND languoid.family_pk IS DISTINCT FROM f.family_pk""")
+
+
+def update_intervals(conn):
+    # lft is the preorder number with siblings ordered by name and id, rgt = lft plus
+    # the number of descendants:
+    conn.execute("""\
+UPDATE languoid SET lft = i.lft, rgt = i.rgt
+FROM (
+    WITH RECURSIVE siblings (pk, father_pk, rank) AS (
+        SELECT ll.pk, ll.father_pk, row_number() OVER (
+            PARTITION BY ll.father_pk ORDER BY l.name COLLATE "C", l.id COLLATE "C")
+        FROM languoid AS ll JOIN language AS l ON ll.pk = l.pk
+    ), tree (pk, path) AS (
+        SELECT pk, ARRAY[rank] FROM siblings WHERE father_pk IS NULL
+        UNION ALL
+        SELECT s.pk, t.path || s.rank FROM tree AS t JOIN siblings AS s ON s.father_pk = t.pk
+    ), preorder (pk, lft) AS (
+        SELECT pk, row_number() OVER (ORDER BY path) FROM tree
+    )
+    SELECT
+        p.pk AS pk,
+        p.lft AS lft,
+        p.lft + (SELECT count(*) FROM treeclosuretable AS c
+                 WHERE c.parent_pk = p.pk AND c.depth > 0) AS rgt
+    FROM preorder AS p
+) AS i
+WHERE languoid.pk = i.pk
+AND (languoid.lft, languoid.rgt) IS DISTINCT FROM (i.lft, i.rgt)""")
+
+
+def update_json(conn, column, values):
+    """Write the JSON encoded values of the column for the languoids where it changed.
+
+    :param values: dict mapping languoid pks to the new values - [] if missing.
+    """
+    update = sa.text('UPDATE languoid SET %s = :value WHERE pk = :pk' % column)
+    rows = [
+        dict(pk=pk, value=json.dumps(values[pk]))
+        for pk, current in conn.execute('SELECT pk, %s FROM languoid' % column)
+        if current is None or json.loads(current) != values[pk]]
+    for i in range(0, len(rows), BATCH_SIZE):
+        conn.execute(update, rows[i:i + BATCH_SIZE])
+
+
+def update_ancestry(conn):
+    # the ancestors as lists [pk, id, name, level, has fc, has sc], starting with the
+    # top-level family:
+    ancestry = defaultdict(list)
+    for row in conn.execute("""\
+SELECT t.child_pk, a.pk, l.id, l.name, a.level, coalesce(f.fc, false), coalesce(f.sc, false)
+FROM treeclosuretable AS t
+JOIN languoid AS a ON t.parent_pk = a.pk
+JOIN language AS l ON a.pk = l.pk
+LEFT OUTER JOIN (
+    SELECT vs.language_pk, bool_or(p.id = 'fc') AS fc, bool_or(p.id = 'sc') AS sc
+    FROM valueset AS vs JOIN parameter AS p ON vs.parameter_pk = p.pk
+    WHERE p.id IN ('fc', 'sc') AND vs.description != ''
+    GROUP BY vs.language_pk
+) AS f ON f.language_pk = a.pk
+WHERE t.depth > 0
+ORDER BY t.child_pk, t.depth DESC"""):
+        ancestry[row[0]].append(list(row[1:]))
+    update_json(conn, 'ancestry', ancestry)
+
+
+def update_screfs(conn):
+    # the sc valueset with references of the languoid itself or its closest ancestor:
+    conn.execute("""\
+UPDATE languoid SET sc_valueset_pk = s.valueset_pk
+FROM (
+    SELECT ll.pk AS pk, v.valueset_pk AS valueset_pk
+    FROM languoid AS ll LEFT OUTER JOIN (
+        SELECT DISTINCT ON (t.child_pk) t.child_pk AS pk, vs.pk AS valueset_pk
+        FROM treeclosuretable AS t, valueset AS vs, parameter AS p
+        WHERE t.parent_pk = vs.language_pk AND vs.parameter_pk = p.pk AND p.id = 'sc'
+        AND EXISTS (SELECT 1 FROM valuesetreference AS r WHERE r.valueset_pk = vs.pk)
+        ORDER BY t.child_pk, t.depth, vs.pk
+    ) AS v ON v.pk = ll.pk
+) AS s
+WHERE languoid.pk = s.pk AND languoid.sc_valueset_pk IS DISTINCT FROM s.valueset_pk""")
+
+
+def update_geocoords(conn):
+    # the coordinates of descendants as lists [branch pk, name, longitude, latitude, id],
+    # where the branch is the child the descendant belongs to, in preorder:
+    geocoords = defaultdict(list)
+    for row in conn.execute("""\
+SELECT t.parent_pk, b.parent_pk, l.name, l.longitude, l.latitude, l.id
+FROM treeclosuretable AS t
+JOIN treeclosuretable AS b ON b.child_pk = t.child_pk AND b.depth = t.depth - 1
+JOIN language AS l ON t.child_pk = l.pk
+JOIN languoid AS ll ON l.pk = ll.pk
+WHERE t.depth > 0 AND l.latitude IS NOT NULL
+ORDER BY t.parent_pk, ll.lft"""):
+        geocoords[row[0]].append(list(row[1:]))
+    update_json(conn, 'geocoords', geocoords)
+
+
+def update_listing(conn):
+    conn.execute('DELETE FROM languoidlisting')
+    conn.execute("""\
+INSERT INTO languoidlisting (
+    active, created, updated, languoid_pk, id, name, level, status, level_label,
+    father_pk, family_id, family_name, iso_code, macroarea_pks, macroareas,
+    child_family_count, child_language_count, child_dialect_count)
+SELECT
+    l.active, now(), now(), l.pk, l.id, l.name, ll.level, ll.status,
+    CASE
+        WHEN ll.father_pk IS NULL AND ll.level = 'family' THEN 'Top-level family'
+        WHEN ll.father_pk IS NULL THEN 'Isolate'
+        ELSE 'Subfamily'
+    END,
+    ll.father_pk, f.id, f.name,
+    CASE WHEN length(ll.hid) = 3 THEN ll.hid END,
+    coalesce(m.pks, '{}'), coalesce(m.names, ''),
+    ll.child_family_count, ll.child_language_count, ll.child_dialect_count
+FROM language AS l
+JOIN languoid AS ll ON l.pk = ll.pk
+LEFT OUTER JOIN language AS f ON f.pk = ll.family_pk
+LEFT OUTER JOIN (
+    SELECT
+        lm.languoid_pk,
+        array_agg(ma.pk ORDER BY ma.id) AS pks,
+        string_agg(ma.name, ', ' ORDER BY ma.id) AS names
+    FROM languoidmacroarea AS lm JOIN macroarea AS ma ON lm.macroarea_pk = ma.pk
+    GROUP BY lm.languoid_pk
+) AS m ON m.languoid_pk = l.pk""")
+
+
+# established or unattested languoids:
+LANGUOIDS = """\
+FROM language AS l JOIN languoid AS ll ON l.pk = ll.pk
+WHERE l.active = true AND ll.status IN ('established', 'unattested')"""
+FAMILIES = LANGUOIDS + " AND ll.father_pk IS NULL AND ll.level = 'family'"
+ISOLATES = LANGUOIDS + " AND ll.father_pk IS NULL AND ll.level = 'language'"
+LANGUAGES = LANGUOIDS + " AND ll.hid IS NOT NULL"
+
+
+def glottolog_statistics(conn):
+    def scalar(sql):
+        return conn.execute(sql).fetchone()[0]
+
+    def pseudo_family_count(condition):
+        return scalar("""\
+SELECT coalesce(sum(ll.child_language_count), 0) %s AND ll.father_pk IS NULL AND %s"""
+            % (LANGUOIDS, condition))
+
+    res = {
+        'last_update': '%s' % scalar('SELECT max(updated) FROM language'),
+        'number_of_families': scalar('SELECT count(*) ' + FAMILIES),
+        'number_of_isolates': scalar('SELECT count(*) ' + ISOLATES),
+    }
+    languages = res['number_of_languages'] = {
+        'all': scalar('SELECT count(*) ' + LANGUAGES),
+        'pidgin': pseudo_family_count("l.name = 'Pidgin'"),
+        'artificial': pseudo_family_count("l.name = 'Artificial Language'"),
+        'sign': pseudo_family_count("l.name LIKE '%%Sign %%'"),
+    }
+    languages['l1'] = languages['all'] \
+        - languages['pidgin'] - languages['artificial'] - languages['sign']
+
+    res['macroareas'] = dict((id_, {
+        'number_of_families': 0,
+        'number_of_isolates': 0,
+        'number_of_languages': 0}) for id_, in conn.execute('SELECT id FROM macroarea'))
+    for key, query in [
+        ('number_of_families', FAMILIES),
+        ('number_of_isolates', ISOLATES),
+        ('number_of_languages', LANGUAGES),
+    ]:
+        for id_, n in conn.execute("""\
+SELECT m.id, count(*) FROM macroarea AS m, languoidmacroarea AS lm, (SELECT l.pk %s) AS l
+WHERE m.pk = lm.macroarea_pk AND lm.languoid_pk = l.pk
+GROUP BY m.id""" % query):
+            res['macroareas'][id_][key] = n
+    return res
+
+
+def provider_statistics(conn):
+    return {
+        'ref_count': dict(('%s' % pk, n) for pk, n in conn.execute("""\
+SELECT p.pk, count(r.ref_pk) FROM provider AS p, refprovider AS r
+WHERE p.pk = r.provider_pk GROUP BY p.pk""")),
+        'totalrefs': conn.execute('SELECT count(*) FROM source').fetchone()[0],
+        'totalnodes': conn.execute('SELECT count(*) FROM language').fetchone()[0],
+    }
+
+
+def update_statistics(conn):
+    for id_, data in [
+        ('glottolog', glottolog_statistics(conn)),
+        ('providers', provider_statistics(conn)),
+    ]:
+        conn.execute(sa.text('DELETE FROM statistics WHERE id = :id'), id=id_)
+        conn.execute(
+            sa.text(
+                'INSERT INTO statistics (active, created, updated, id, data) '
+                'VALUES (true, now(), now(), :id, :data)'),
+            id=id_, data=json.dumps(data))
+
+
+def refresh(conn):
+    """Update the data derived from the languoid tree after the changes of the curator,
+    and mark cached data as stale.
+    """
+    check_tree(conn)
+    update_closure(conn)
+    update_family(conn)
+    update_intervals(conn)
+    update_ancestry(conn)
+    update_screfs(conn)
+    update_geocoords(conn)
+    update_listing(conn)
+    update_statistics(conn)
+    conn.execute('UPDATE dataset SET updated = now()')
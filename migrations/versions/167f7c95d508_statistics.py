@@ -0,0 +1,101 @@
+# coding=utf-8
+"""statistics snapshots
+
+Revision ID: 167f7c95d508
+Revises: a3a126625565
+Create Date: 2026-10-16 13:07:22.615028
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '167f7c95d508'
+down_revision = 'a3a126625565'
+
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+# established or unattested languoids:
+LANGUOIDS = """\
+FROM language AS l JOIN languoid AS ll ON l.pk = ll.pk
+WHERE l.active = true AND ll.status IN ('established', 'unattested')"""
+FAMILIES = LANGUOIDS + " AND ll.father_pk IS NULL AND ll.level = 'family'"
+ISOLATES = LANGUOIDS + " AND ll.father_pk IS NULL AND ll.level = 'language'"
+LANGUAGES = LANGUOIDS + " AND ll.hid IS NOT NULL"
+
+
+def glottolog_statistics(conn):
+    def scalar(sql):
+        return conn.execute(sql).fetchone()[0]
+
+    def pseudo_family_count(condition):
+        return scalar("""\
+SELECT coalesce(sum(ll.child_language_count), 0) %s AND ll.father_pk IS NULL AND %s"""
+            % (LANGUOIDS, condition))
+
+    res = {
+        'last_update': '%s' % scalar('SELECT max(updated) FROM language'),
+        'number_of_families': scalar('SELECT count(*) ' + FAMILIES),
+        'number_of_isolates': scalar('SELECT count(*) ' + ISOLATES),
+    }
+    languages = res['number_of_languages'] = {
+        'all': scalar('SELECT count(*) ' + LANGUAGES),
+        'pidgin': pseudo_family_count("l.name = 'Pidgin'"),
+        'artificial': pseudo_family_count("l.name = 'Artificial Language'"),
+        'sign': pseudo_family_count("l.name LIKE '%%Sign %%'"),
+    }
+    languages['l1'] = languages['all'] \
+        - languages['pidgin'] - languages['artificial'] - languages['sign']
+
+    res['macroareas'] = dict((id_, {
+        'number_of_families': 0,
+        'number_of_isolates': 0,
+        'number_of_languages': 0}) for id_, in conn.execute('SELECT id FROM macroarea'))
+    for key, query in [
+        ('number_of_families', FAMILIES),
+        ('number_of_isolates', ISOLATES),
+        ('number_of_languages', LANGUAGES),
+    ]:
+        for id_, n in conn.execute("""\
+SELECT m.id, count(*) FROM macroarea AS m, languoidmacroarea AS lm, (SELECT l.pk %s) AS l
+WHERE m.pk = lm.macroarea_pk AND lm.languoid_pk = l.pk
+GROUP BY m.id""" % query):
+            res['macroareas'][id_][key] = n
+    return res
+
+
+def provider_statistics(conn):
+    return {
+        'ref_count': dict(('%s' % pk, n) for pk, n in conn.execute("""\
+SELECT p.pk, count(r.ref_pk) FROM provider AS p, refprovider AS r
+WHERE p.pk = r.provider_pk GROUP BY p.pk""")),
+        'totalrefs': conn.execute('SELECT count(*) FROM source').fetchone()[0],
+        'totalnodes': conn.execute('SELECT count(*) FROM language').fetchone()[0],
+    }
+
+
+def upgrade():
+    op.create_table(
+        'statistics',
+        sa.Column('pk', sa.Integer, primary_key=True),
+        sa.Column('created', sa.DateTime(timezone=True)),
+        sa.Column('updated', sa.DateTime(timezone=True)),
+        sa.Column('active', sa.Boolean),
+        sa.Column('jsondata', sa.Unicode),
+        sa.Column('id', sa.Unicode, unique=True),
+        sa.Column('data', sa.Unicode))
+    conn = op.get_bind()
+    for id_, data in [
+        ('glottolog', glottolog_statistics(conn)),
+        ('providers', provider_statistics(conn)),
+    ]:
+        conn.execute(
+            sa.text(
+                'INSERT INTO statistics (active, created, updated, id, data) '
+                'VALUES (true, now(), now(), :id, :data)'),
+            id=id_, data=json.dumps(data))
+
+
+def downgrade():
+    op.drop_table('statistics')
@@ -0,0 +1,50 @@
+# coding=utf-8
+"""nested intervals for languoids
+
+Revision ID: 199f4d7369e7
+Revises: 5113368c7dbe
+Create Date: 2026-10-16 09:12:31.118326
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '199f4d7369e7'
+down_revision = '5113368c7dbe'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('languoid', sa.Column('lft', sa.Integer))
+    op.add_column('languoid', sa.Column('rgt', sa.Integer))
+    op.create_index('ix_languoid_lft', 'languoid', ['lft'])
+    conn = op.get_bind()
+    # lft is the preorder number with siblings ordered by name and id, rgt = lft plus
+    # the number of descendants:
+    conn.execute("""\
+UPDATE languoid SET lft = i.lft, rgt = i.lft + i.descendants
+FROM (
+    WITH RECURSIVE siblings (pk, father_pk, rank) AS (
+        SELECT ll.pk, ll.father_pk, row_number() OVER (
+            PARTITION BY ll.father_pk ORDER BY l.name COLLATE "C", l.id COLLATE "C")
+        FROM languoid AS ll JOIN language AS l ON ll.pk = l.pk
+    ), tree (pk, path) AS (
+        SELECT pk, ARRAY[rank] FROM siblings WHERE father_pk IS NULL
+        UNION ALL
+        SELECT s.pk, t.path || s.rank FROM tree AS t JOIN siblings AS s ON s.father_pk = t.pk
+    )
+    SELECT
+        tree.pk AS pk,
+        row_number() OVER (ORDER BY tree.path) AS lft,
+        (SELECT count(*) FROM treeclosuretable AS c
+         WHERE c.parent_pk = tree.pk AND c.depth > 0) AS descendants
+    FROM tree
+) AS i
+WHERE languoid.pk = i.pk""")
+
+
+def downgrade():
+    op.drop_index('ix_languoid_lft', 'languoid')
+    op.drop_column('languoid', 'rgt')
+    op.drop_column('languoid', 'lft')
@@ -0,0 +1,25 @@
+# coding=utf-8
+"""index for keyset pagination of references
+
+Revision ID: 1b3f4d0995a5
+Revises: 80174cfe614c
+Create Date: 2026-10-16 20:40:54.303029
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1b3f4d0995a5'
+down_revision = '80174cfe614c'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute("""\
+CREATE INDEX ix_source_author_year_pk
+ON source (coalesce(author, ''), coalesce(year, ''), pk)""")
+
+
+def downgrade():
+    op.drop_index('ix_source_author_year_pk', 'source')
@@ -0,0 +1,37 @@
+# coding=utf-8
+"""effective subclassification justifications
+
+Revision ID: 684b8dde7817
+Revises: 84fdbf9d6ecf
+Create Date: 2026-10-16 11:20:14.306718
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '684b8dde7817'
+down_revision = '84fdbf9d6ecf'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column(
+        'languoid',
+        sa.Column('sc_valueset_pk', sa.Integer, sa.ForeignKey('valueset.pk')))
+    conn = op.get_bind()
+    # the sc valueset with references of the languoid itself or its closest ancestor:
+    conn.execute("""\
+UPDATE languoid SET sc_valueset_pk = s.valueset_pk
+FROM (
+    SELECT DISTINCT ON (t.child_pk) t.child_pk AS pk, vs.pk AS valueset_pk
+    FROM treeclosuretable AS t, valueset AS vs, parameter AS p
+    WHERE t.parent_pk = vs.language_pk AND vs.parameter_pk = p.pk AND p.id = 'sc'
+    AND EXISTS (SELECT 1 FROM valuesetreference AS r WHERE r.valueset_pk = vs.pk)
+    ORDER BY t.child_pk, t.depth, vs.pk
+) AS s
+WHERE languoid.pk = s.pk""")
+
+
+def downgrade():
+    op.drop_column('languoid', 'sc_valueset_pk')
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""denormalized languoid listing
+
+Revision ID: 80174cfe614c
+Revises: bf0f3d812db3
+Create Date: 2026-10-16 20:38:32.517122
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '80174cfe614c'
+down_revision = 'bf0f3d812db3'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    level = postgresql.ENUM(name='ck_languoid_level', create_type=False)
+    status = postgresql.ENUM(name='ck_languoid_status', create_type=False)
+    op.create_table(
+        'languoidlisting',
+        sa.Column('pk', sa.Integer, primary_key=True),
+        sa.Column('created', sa.DateTime(timezone=True)),
+        sa.Column('updated', sa.DateTime(timezone=True)),
+        sa.Column('active', sa.Boolean),
+        sa.Column('jsondata', sa.Unicode),
+        sa.Column('languoid_pk', sa.Integer, sa.ForeignKey('languoid.pk'), unique=True),
+        sa.Column('id', sa.String),
+        sa.Column('name', sa.Unicode),
+        sa.Column('level', level),
+        sa.Column('status', status),
+        sa.Column('level_label', sa.Unicode),
+        sa.Column('father_pk', sa.Integer),
+        sa.Column('family_id', sa.String),
+        sa.Column('family_name', sa.Unicode),
+        sa.Column('iso_code', sa.Unicode),
+        sa.Column('macroarea_pks', postgresql.ARRAY(sa.Integer)),
+        sa.Column('macroareas', sa.Unicode),
+        sa.Column('child_family_count', sa.Integer),
+        sa.Column('child_language_count', sa.Integer),
+        sa.Column('child_dialect_count', sa.Integer))
+    op.create_index('ix_languoidlisting_id', 'languoidlisting', ['id'])
+    op.create_index('ix_languoidlisting_name', 'languoidlisting', ['name'])
+    op.create_index('ix_languoidlisting_family_name', 'languoidlisting', ['family_name'])
+    op.create_index(
+        'ix_languoidlisting_macroarea_pks', 'languoidlisting', ['macroarea_pks'],
+        postgresql_using='gin')
+    conn = op.get_bind()
+    conn.execute("""\
+INSERT INTO languoidlisting (
+    active, created, updated, languoid_pk, id, name, level, status, level_label,
+    father_pk, family_id, family_name, iso_code, macroarea_pks, macroareas,
+    child_family_count, child_language_count, child_dialect_count)
+SELECT
+    l.active, now(), now(), l.pk, l.id, l.name, ll.level, ll.status,
+    CASE
+        WHEN ll.father_pk IS NULL AND ll.level = 'family' THEN 'Top-level family'
+        WHEN ll.father_pk IS NULL THEN 'Isolate'
+        ELSE 'Subfamily'
+    END,
+    ll.father_pk, f.id, f.name,
+    CASE WHEN length(ll.hid) = 3 THEN ll.hid END,
+    coalesce(m.pks, '{}'), coalesce(m.names, ''),
+    ll.child_family_count, ll.child_language_count, ll.child_dialect_count
+FROM language AS l
+JOIN languoid AS ll ON l.pk = ll.pk
+LEFT OUTER JOIN language AS f ON f.pk = ll.family_pk
+LEFT OUTER JOIN (
+    SELECT
+        lm.languoid_pk,
+        array_agg(ma.pk ORDER BY ma.id) AS pks,
+        string_agg(ma.name, ', ' ORDER BY ma.id) AS names
+    FROM languoidmacroarea AS lm JOIN macroarea AS ma ON lm.macroarea_pk = ma.pk
+    GROUP BY lm.languoid_pk
+) AS m ON m.languoid_pk = l.pk""")
+
+
+def downgrade():
+    op.drop_table('languoidlisting')
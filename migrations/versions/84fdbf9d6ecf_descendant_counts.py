@@ -0,0 +1,56 @@
+# coding=utf-8
+"""descendant counts per level, status and macroarea
+
+Revision ID: 84fdbf9d6ecf
+Revises: edb6e55b5eb7
+Create Date: 2026-10-16 10:41:05.874310
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '84fdbf9d6ecf'
+down_revision = 'edb6e55b5eb7'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    level = postgresql.ENUM(name='ck_languoid_level', create_type=False)
+    status = postgresql.ENUM(name='ck_languoid_status', create_type=False)
+    op.create_table(
+        'descendantcount',
+        sa.Column('pk', sa.Integer, primary_key=True),
+        sa.Column('created', sa.DateTime(timezone=True)),
+        sa.Column('updated', sa.DateTime(timezone=True)),
+        sa.Column('active', sa.Boolean),
+        sa.Column('jsondata', sa.Unicode),
+        sa.Column('languoid_pk', sa.Integer, sa.ForeignKey('languoid.pk')),
+        sa.Column('macroarea_pk', sa.Integer, sa.ForeignKey('macroarea.pk')),
+        sa.Column('level', level),
+        sa.Column('status', status),
+        sa.Column('count', sa.Integer))
+    op.create_index(
+        'ix_descendantcount_languoid_pk', 'descendantcount', ['languoid_pk'])
+    conn = op.get_bind()
+    # the totals, with macroarea_pk NULL, and the counts per macroarea:
+    conn.execute("""\
+INSERT INTO descendantcount
+    (active, created, updated, languoid_pk, macroarea_pk, level, status, count)
+SELECT true, now(), now(), t.parent_pk, NULL, l.level, l.status, count(*)
+FROM treeclosuretable AS t JOIN languoid AS l ON t.child_pk = l.pk
+WHERE t.depth > 0
+GROUP BY t.parent_pk, l.level, l.status""")
+    conn.execute("""\
+INSERT INTO descendantcount
+    (active, created, updated, languoid_pk, macroarea_pk, level, status, count)
+SELECT true, now(), now(), t.parent_pk, m.macroarea_pk, l.level, l.status, count(*)
+FROM treeclosuretable AS t JOIN languoid AS l ON t.child_pk = l.pk
+JOIN languoidmacroarea AS m ON m.languoid_pk = l.pk
+WHERE t.depth > 0
+GROUP BY t.parent_pk, m.macroarea_pk, l.level, l.status""")
+
+
+def downgrade():
+    op.drop_table('descendantcount')
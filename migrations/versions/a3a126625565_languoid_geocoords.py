@@ -0,0 +1,46 @@
+# coding=utf-8
+"""precomputed coordinates of descendants
+
+Revision ID: a3a126625565
+Revises: 684b8dde7817
+Create Date: 2026-10-16 11:58:40.092145
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a3a126625565'
+down_revision = '684b8dde7817'
+
+import json
+from collections import defaultdict
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('languoid', sa.Column('geocoords', sa.Unicode))
+    conn = op.get_bind()
+    # the coordinates of descendants as lists [branch pk, name, longitude, latitude, id],
+    # where the branch is the child the descendant belongs to, in preorder:
+    geocoords = defaultdict(list)
+    for row in conn.execute("""\
+SELECT t.parent_pk, b.parent_pk, l.name, l.longitude, l.latitude, l.id
+FROM treeclosuretable AS t
+JOIN treeclosuretable AS b ON b.child_pk = t.child_pk AND b.depth = t.depth - 1
+JOIN language AS l ON t.child_pk = l.pk
+JOIN languoid AS ll ON l.pk = ll.pk
+WHERE t.depth > 0 AND l.latitude IS NOT NULL
+ORDER BY t.parent_pk, ll.lft"""):
+        geocoords[row[0]].append(list(row[1:]))
+
+    update = sa.text('UPDATE languoid SET geocoords = :geocoords WHERE pk = :pk')
+    rows = [
+        dict(pk=pk, geocoords=json.dumps(geocoords[pk]))
+        for pk, in conn.execute('SELECT pk FROM languoid')]
+    for i in range(0, len(rows), 10000):
+        conn.execute(update, rows[i:i + 10000])
+
+
+def downgrade():
+    op.drop_column('languoid', 'geocoords')
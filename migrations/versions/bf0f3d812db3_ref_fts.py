@@ -0,0 +1,31 @@
+# coding=utf-8
+"""full-text search documents for references
+
+Revision ID: bf0f3d812db3
+Revises: 167f7c95d508
+Create Date: 2026-10-16 20:37:34.044321
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'bf0f3d812db3'
+down_revision = '167f7c95d508'
+
+from alembic import op
+from sqlalchemy.dialects.postgresql import TSVECTOR
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('ref', sa.Column('fts', TSVECTOR))
+    conn = op.get_bind()
+    conn.execute("""\
+UPDATE ref SET fts = to_tsvector('simple', concat_ws(
+    ' ', s.author, s.year, s.title, s.editor, s.journal, s.address, s.publisher))
+FROM source AS s WHERE s.pk = ref.pk""")
+    op.create_index('ix_ref_fts', 'ref', ['fts'], postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_ref_fts', 'ref')
+    op.drop_column('ref', 'fts')
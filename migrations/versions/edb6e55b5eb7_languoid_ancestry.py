@@ -0,0 +1,51 @@
+# coding=utf-8
+"""materialized ancestry of languoids
+
+Revision ID: edb6e55b5eb7
+Revises: 199f4d7369e7
+Create Date: 2026-10-16 10:03:47.520193
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'edb6e55b5eb7'
+down_revision = '199f4d7369e7'
+
+import json
+from collections import defaultdict
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('languoid', sa.Column('ancestry', sa.Unicode))
+    conn = op.get_bind()
+    # the ancestors as lists [pk, id, name, level, has fc, has sc], starting with the
+    # top-level family:
+    ancestry = defaultdict(list)
+    for row in conn.execute("""\
+SELECT t.child_pk, a.pk, l.id, l.name, a.level, coalesce(f.fc, false), coalesce(f.sc, false)
+FROM treeclosuretable AS t
+JOIN languoid AS a ON t.parent_pk = a.pk
+JOIN language AS l ON a.pk = l.pk
+LEFT OUTER JOIN (
+    SELECT vs.language_pk, bool_or(p.id = 'fc') AS fc, bool_or(p.id = 'sc') AS sc
+    FROM valueset AS vs JOIN parameter AS p ON vs.parameter_pk = p.pk
+    WHERE p.id IN ('fc', 'sc') AND vs.description != ''
+    GROUP BY vs.language_pk
+) AS f ON f.language_pk = a.pk
+WHERE t.depth > 0
+ORDER BY t.child_pk, t.depth DESC"""):
+        ancestry[row[0]].append(list(row[1:]))
+
+    update = sa.text('UPDATE languoid SET ancestry = :ancestry WHERE pk = :pk')
+    rows = [
+        dict(pk=pk, ancestry=json.dumps(ancestry[pk]))
+        for pk, in conn.execute('SELECT pk FROM languoid')]
+    for i in range(0, len(rows), 10000):
+        conn.execute(update, rows[i:i + 10000])
+
+
+def downgrade():
+    op.drop_column('languoid', 'ancestry')